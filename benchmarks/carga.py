@@ -0,0 +1,344 @@
+# Prueba de carga y de relevancia de la api de busqueda.
+#
+# Reproduce un log de consultas JSONL con la concurrencia indicada y reporta throughput, latencia p50/p95/p99,
+# tiempo en elastic vs overhead del servicio y tiempo de embedding. Con --judgments calcula nDCG@k y recall@k.
+#
+# Modos:
+#   --url http://localhost:8000     api desplegada (solo latencia vista por el cliente)
+#   --es http://localhost:9200      app en proceso contra un cluster real, --record graba las respuestas
+#   --replay grabaciones.jsonl      app en proceso contra las respuestas grabadas, sin cluster
+#
+# Log de consultas (una por linea):  {"endpoint": "regular_search", "query": "ley 100", "body": {"limit": 10}}
+# Juicios de relevancia:             {"endpoint": "regular_search", "query": "ley 100", "relevant": {"<doc-name>": 2}}
+#
+# Con --repeat el log se reproduce varias veces: la primera pasada se reporta como "cold" y las demas como "warm",
+# porque repiten las mismas consultas contra el cache de resultados, de agregaciones y de embeddings.
+# En proceso los caches se vacian antes de la primera pasada, --no-cache los vacia antes de cada una (todas cold).
+# Contra --url los caches del servidor no se pueden vaciar: la pasada cold solo es fria si el servidor recien arranca.
+#
+# Uso: python -m benchmarks.carga benchmarks/consultas.jsonl --replay grabaciones.jsonl -c 16 --repeat 5
+import argparse
+import asyncio
+import contextvars
+import copy
+import hashlib
+import json
+import math
+import time
+from collections import defaultdict
+import httpx
+import numpy as np
+import orjson
+
+ENDPOINTS = { # nombre -> (metodo, ruta, parametro con el texto de busqueda)
+    "regular_search": ("POST", "/api/v1/regular_search/", "search_query"),
+    "semantic_search": ("POST", "/api/v1/semantic_search", "search_query"),
+    "hybrid_search": ("POST", "/api/v1/hybrid_search", "search_query"),
+    "filter_fragments": ("POST", "/api/v1/filter_fragments", "search_query"),
+    "search_with_facets": ("POST", "/api/v1/search_with_facets", "search_query"),
+    "get_selects": ("GET", "/api/v1/search/filters", None),
+    "suggest": ("GET", "/api/v1/suggest", "prefix"),
+}
+
+# Tiempos de la peticion en curso, los llena el cliente de elastic envuelto y el embedding medido
+_tiempos = contextvars.ContextVar("tiempos", default=None)
+
+def _sin_vectores(obj):
+    # Los vectores cambian un poco segun el backend del modelo, no deben cambiar la llave de la grabacion
+    if isinstance(obj, np.ndarray):
+        return "<vector>"
+    if isinstance(obj, dict):
+        return {k: _sin_vectores(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sin_vectores(v) for v in obj]
+    return obj
+
+def _llave(metodo: str, kwargs: dict) -> str:
+    datos = orjson.dumps([metodo, _sin_vectores(kwargs)], option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return hashlib.sha1(datos).hexdigest()
+
+# Envuelve el cliente de elastic: mide cada llamada y graba o reproduce las respuestas
+class ESMedido:
+    def __init__(self, real=None, grabaciones=None, archivo=None, simular_latencia=False, ruta=()):
+        self._real = real
+        self._grabaciones = grabaciones if grabaciones is not None else {}
+        self._archivo = archivo
+        self._simular_latencia = simular_latencia
+        self._ruta = ruta
+
+    def _hijo(self, real, ruta):
+        return ESMedido(real, self._grabaciones, self._archivo, self._simular_latencia, ruta)
+
+    def __getattr__(self, nombre):
+        return self._hijo(getattr(self._real, nombre) if self._real is not None else None, self._ruta + (nombre,))
+
+    def options(self, **kwargs):
+        return self._hijo(self._real.options(**kwargs) if self._real is not None else None, self._ruta)
+
+    async def close(self):
+        if self._archivo:
+            self._archivo.close()
+        if self._real is not None:
+            await self._real.close()
+
+    async def __call__(self, **kwargs):
+        metodo = ".".join(self._ruta)
+        if kwargs.get("filter_path"):
+            kwargs = {**kwargs, "filter_path": list(kwargs["filter_path"]) + ["took"]}
+        llave = _llave(metodo, kwargs)
+
+        inicio = time.perf_counter()
+        if self._real is not None:
+            respuesta = await self._real(**kwargs)
+            cuerpo = respuesta.body
+            if self._archivo:
+                self._grabaciones[llave] = cuerpo
+                self._archivo.write(orjson.dumps({"key": llave, "method": metodo, "body": cuerpo}) + b"\n")
+        else:
+            if llave not in self._grabaciones:
+                raise KeyError(f"No hay respuesta grabada para {metodo}")
+            cuerpo = self._grabaciones[llave]
+            if self._simular_latencia and isinstance(cuerpo, dict):
+                await asyncio.sleep(cuerpo.get("took", 0) / 1000)
+            respuesta = cuerpo = copy.deepcopy(cuerpo) # Los handlers modifican los hits
+
+        tiempos = _tiempos.get()
+        if tiempos is not None:
+            tiempos["es"] += time.perf_counter() - inicio
+            if isinstance(cuerpo, dict):
+                tiempos["took"] += cuerpo.get("took", 0) / 1000
+
+        return respuesta
+
+def _cargar_jsonl(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+async def _crear_cliente(args):
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, timeout=30), None
+
+    import main
+
+    if args.replay:
+        grabaciones = {g["key"]: g["body"] for g in _cargar_jsonl(args.replay)}
+        es = ESMedido(grabaciones=grabaciones, simular_latencia=args.simulate_latency)
+    else:
+        from elasticsearch import AsyncElasticsearch
+        from utils import _es_client_options
+        archivo = open(args.record, "ab") if args.record else None
+        es = ESMedido(AsyncElasticsearch(args.es, **_es_client_options()), archivo=archivo)
+
+    # Sin lifespan: el cliente medido reemplaza al del app y el embedding se mide por separado
+    main.app.state.es = es
+    original = main.get_query_embedding
+
+    async def embedding_medido(texto):
+        inicio = time.perf_counter()
+        try:
+            return await original(texto)
+        finally:
+            tiempos = _tiempos.get()
+            if tiempos is not None:
+                tiempos["emb"] += time.perf_counter() - inicio
+
+    main.get_query_embedding = embedding_medido
+    transporte = httpx.ASGITransport(app=main.app)
+    return httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=30), es
+
+# Caches de la app en proceso, para que las pasadas midan busquedas y no aciertos de cache
+async def _vaciar_caches():
+    import main
+
+    for cache in (main.embedding_cache, main.aggs_cache, main.suggest_cache):
+        cache.clear()
+    await main.result_cache.clear()
+
+async def _ejecutar(cliente: httpx.AsyncClient, consulta: dict):
+    metodo, ruta, parametro = ENDPOINTS[consulta["endpoint"]]
+    params = {parametro: consulta["query"]} if parametro else {}
+    if consulta["endpoint"] == "suggest":
+        params.update(consulta.get("params", {}))
+
+    tiempos = {"es": 0.0, "took": 0.0, "emb": 0.0}
+    token = _tiempos.set(tiempos)
+    inicio = time.perf_counter()
+    try:
+        respuesta = await cliente.request(
+            metodo,
+            ruta,
+            params=params,
+            json=consulta.get("body", {}) if metodo == "POST" else None
+        )
+    finally:
+        _tiempos.reset(token)
+
+    return respuesta, time.perf_counter() - inicio, tiempos
+
+async def carga(cliente, consultas: list, concurrencia: int) -> tuple:
+    cola = asyncio.Queue()
+    for consulta in consultas:
+        cola.put_nowait(consulta)
+
+    resultados = defaultdict(lambda: {"latencias": [], "es": [], "took": [], "emb": [], "errores": 0})
+
+    async def worker():
+        while not cola.empty():
+            consulta = cola.get_nowait()
+            r = resultados[consulta["endpoint"]]
+            try:
+                respuesta, latencia, tiempos = await _ejecutar(cliente, consulta)
+            except Exception:
+                r["errores"] += 1
+                continue
+            if respuesta.status_code >= 400:
+                r["errores"] += 1
+                continue
+            r["latencias"].append(latencia)
+            r["es"].append(tiempos["es"])
+            r["took"].append(tiempos["took"])
+            r["emb"].append(tiempos["emb"])
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrencia)))
+    return resultados, time.perf_counter() - inicio
+
+def _ndcg(ranking: list, relevantes: dict, k: int) -> float:
+    dcg = sum((2 ** relevantes.get(doc, 0) - 1) / math.log2(i + 2) for i, doc in enumerate(ranking[:k]))
+    ideal = sorted(relevantes.values(), reverse=True)[:k]
+    idcg = sum((2 ** grado - 1) / math.log2(i + 2) for i, grado in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+def _recall(ranking: list, relevantes: dict, k: int) -> float:
+    positivos = {doc for doc, grado in relevantes.items() if grado > 0}
+    return len(positivos & set(ranking[:k])) / len(positivos) if positivos else 0.0
+
+async def relevancia(cliente, juicios: list, k: int) -> dict:
+    metricas = defaultdict(lambda: {"ndcg": [], "recall": []})
+
+    for juicio in juicios:
+        consulta = {**juicio, "body": {**juicio.get("body", {}), "limit": k}}
+        respuesta, _, _ = await _ejecutar(cliente, consulta)
+        hits = respuesta.json().get("hits", []) if respuesta.status_code < 400 else []
+        ranking = [hit.get("_source", {}).get("doc-name") for hit in hits]
+
+        m = metricas[juicio["endpoint"]]
+        m["ndcg"].append(_ndcg(ranking, juicio["relevant"], k))
+        m["recall"].append(_recall(ranking, juicio["relevant"], k))
+
+    return {
+        endpoint: {
+            f"ndcg@{k}": sum(m["ndcg"]) / len(m["ndcg"]),
+            f"recall@{k}": sum(m["recall"]) / len(m["recall"]),
+            "queries": len(m["ndcg"]),
+        }
+        for endpoint, m in metricas.items()
+    }
+
+# Junta los resultados de varias pasadas de carga()
+def _unir(pasadas: list) -> tuple:
+    resultados = defaultdict(lambda: {"latencias": [], "es": [], "took": [], "emb": [], "errores": 0})
+    for parcial, _ in pasadas:
+        for endpoint, r in parcial.items():
+            for campo, valor in r.items():
+                resultados[endpoint][campo] += valor
+    return resultados, sum(duracion for _, duracion in pasadas)
+
+def _ms(valores: list, p=None) -> float:
+    if not valores:
+        return float("nan")
+    return (_percentil(valores, p) if p else sum(valores) / len(valores)) * 1000
+
+def reporte(resultados: dict, duracion: float) -> dict:
+    salida = {}
+    for endpoint, r in sorted(resultados.items()):
+        n = len(r["latencias"])
+        overhead = [lat - es for lat, es in zip(r["latencias"], r["es"])]
+        salida[endpoint] = {
+            "requests": n,
+            "errors": r["errores"],
+            "rps": n / duracion if duracion else 0.0,
+            "p50_ms": _ms(r["latencias"], 50),
+            "p95_ms": _ms(r["latencias"], 95),
+            "p99_ms": _ms(r["latencias"], 99),
+            "es_ms": _ms(r["es"]),
+            "es_took_ms": _ms(r["took"]),
+            "service_overhead_ms": _ms(overhead),
+            "embedding_ms": _ms(r["emb"]),
+        }
+    return salida
+
+def _imprimir(salida: dict):
+    columnas = ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "es_ms", "es_took_ms", "service_overhead_ms", "embedding_ms"]
+    print(f"{'endpoint':<20}" + "".join(f"{c:>14}" for c in columnas))
+    for endpoint, fila in salida.items():
+        print(f"{endpoint:<20}" + "".join(f"{fila[c]:>14.1f}" if isinstance(fila[c], float) else f"{fila[c]:>14}" for c in columnas))
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="Log de consultas JSONL")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument("--url")
+    destino.add_argument("--es")
+    destino.add_argument("--replay")
+    parser.add_argument("--record", help="Con --es, archivo donde se graban las respuestas")
+    parser.add_argument("--simulate-latency", action="store_true", help="Con --replay, espera el took grabado")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="Pasadas del log, la primera se reporta aparte (cold)")
+    parser.add_argument("--no-cache", action="store_true", help="En proceso, vacia los caches antes de cada pasada")
+    parser.add_argument("--judgments", help="Juicios de relevancia JSONL")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Imprime el reporte como JSON")
+    args = parser.parse_args()
+    if args.no_cache and args.url:
+        parser.error("--no-cache solo aplica a la app en proceso (--es o --replay)")
+
+    consultas = _cargar_jsonl(args.queries)
+    cliente, es = await _crear_cliente(args)
+
+    try:
+        # Una pasada de calentamiento para cargar el modelo y las conexiones
+        await carga(cliente, consultas[:args.concurrency], args.concurrency)
+
+        pasadas = []
+        for numero in range(args.repeat):
+            if es is not None and (numero == 0 or args.no_cache):
+                await _vaciar_caches() # Sin lo que dejo el calentamiento (o la pasada anterior)
+            pasadas.append(await carga(cliente, consultas, args.concurrency))
+
+        # Sin --no-cache las pasadas siguientes repiten consultas ya cacheadas, se reportan aparte
+        grupos = {"cold": pasadas} if args.no_cache else {"cold": pasadas[:1], "warm": pasadas[1:]}
+        salida = {}
+        for nombre, grupo in grupos.items():
+            if grupo:
+                resultados, duracion = _unir(grupo)
+                salida[nombre] = {"passes": len(grupo), "duration_s": duracion, "endpoints": reporte(resultados, duracion)}
+
+        if args.judgments:
+            salida["relevance"] = await relevancia(cliente, _cargar_jsonl(args.judgments), args.k)
+    finally:
+        await cliente.aclose()
+        if es is not None:
+            await es.close()
+
+    if args.json:
+        print(json.dumps(salida, indent=2))
+        return
+
+    for nombre in ("cold", "warm"):
+        if nombre in salida:
+            grupo = salida[nombre]
+            print(f"\n[{nombre}] {grupo['passes']} pasada(s), {grupo['duration_s']:.1f}s con concurrencia {args.concurrency}")
+            _imprimir(grupo["endpoints"])
+    print()
+    for endpoint, m in salida.get("relevance", {}).items():
+        print(f"{endpoint}: " + ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in m.items()))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+# Costo de build_faceta con miles de valores de Tipo/Entidad: startswith por clave (implementacion anterior) vs clasificador precompilado
+# Uso: python -m benchmarks.faceta --tipos 2000 --entidades 20
+import argparse
+import random
+import timeit
+from config import JERARQUIA_FACETA
+from faceta import ClasificadorFaceta
+
+def build_faceta_anterior(aggs: dict) -> dict:
+    normativa, jurisprudencia, otros = [], [], []
+
+    for tipo_doc in aggs["tipo"]["buckets"]:
+        tipo = tipo_doc["key"].lower()
+        for grupo, destino in (("Normativa", normativa), ("Jurisprudencia", jurisprudencia)):
+            clave = next((c for c in JERARQUIA_FACETA[grupo] if tipo.startswith(c)), None)
+            if clave is not None:
+                tipo_doc["_orden"] = clave
+                destino.append(tipo_doc)
+                break
+        else:
+            otros.append(tipo_doc)
+
+    orden_normativa = {tipo: idx for idx, tipo in enumerate(JERARQUIA_FACETA["Normativa"])}
+    orden_jurisprudencia = {tipo: idx for idx, tipo in enumerate(JERARQUIA_FACETA["Jurisprudencia"])}
+    normativa.sort(key=lambda x: orden_normativa.get(x["_orden"], 999))
+    jurisprudencia.sort(key=lambda x: orden_jurisprudencia.get(x["_orden"], 999))
+
+    return {"tipo": {"normativa": normativa, "jurisprudencia": jurisprudencia, "other": otros}}
+
+def _aggs_sinteticas(num_tipos: int, num_entidades: int) -> dict:
+    random.seed(0)
+    claves = [c for claves in JERARQUIA_FACETA.values() for c in claves] + ["resoluciones", "circulares", "conceptos"]
+    buckets = []
+
+    for i in range(num_tipos):
+        entidades = [
+            {
+                "key": f"{random.choice(['Ministerio', 'MINISTERIO', 'Ministério'])} {j}",
+                "doc_count": 3,
+                "year": {"buckets": [{"key": y, "key_as_string": str(1990 + y), "doc_count": 1} for y in range(3)]},
+            }
+            for j in range(num_entidades)
+        ]
+        buckets.append({
+            "key": f"{random.choice(claves).title()} {i}",
+            "doc_count": 3 * num_entidades,
+            "entidad": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": entidades},
+        })
+
+    return {"tipo": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0, "buckets": sorted(buckets, key=lambda b: b["key"])}}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tipos", type=int, default=2000)
+    parser.add_argument("--entidades", type=int, default=20)
+    args = parser.parse_args()
+
+    aggs = _aggs_sinteticas(args.tipos, args.entidades)
+    clasificador = ClasificadorFaceta(JERARQUIA_FACETA)
+
+    # Solo el primer nivel, que es lo que hacia la version anterior
+    solo_tipos = {"tipo": {**aggs["tipo"], "buckets": [{"key": b["key"], "doc_count": b["doc_count"]} for b in aggs["tipo"]["buckets"]]}}
+
+    n = 20
+    anterior = min(timeit.repeat(lambda: build_faceta_anterior(solo_tipos), number=n, repeat=5)) / n
+    nuevo = min(timeit.repeat(lambda: clasificador.build(solo_tipos), number=n, repeat=5)) / n
+    completo = min(timeit.repeat(lambda: clasificador.build(aggs), number=n, repeat=5)) / n
+
+    print(f"{args.tipos} tipos, {args.entidades} entidades por tipo")
+    print(f"anterior (solo tipo):        {anterior * 1000:.2f} ms")
+    print(f"nuevo (solo tipo):           {nuevo * 1000:.2f} ms ({anterior / nuevo:.1f}x)")
+    print(f"nuevo (tipo+entidad+year):   {completo * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
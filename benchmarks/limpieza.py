@@ -0,0 +1,43 @@
+# Costo por documento de la limpieza de html: BeautifulSoup (implementacion anterior) vs texto.limpiar_html
+# Uso: python -m benchmarks.limpieza [metadatos/archivo.htm ...]
+# BeautifulSoup solo se necesita para la comparacion: pip install beautifulsoup4
+import sys
+import timeit
+from bs4 import BeautifulSoup
+from texto import limpiar_html
+
+def limpiar_html_bs4(texto):
+    soup = BeautifulSoup(texto, "html.parser")
+    return soup.get_text(separator=" ")
+
+CONSULTAS = [
+    "ley 100 de 1993",
+    "constitución política artículo 86 acción de tutela",
+    "1437",
+]
+
+HTML_SINTETICO = (
+    "<html><head><style>p {margin: 0}</style><script>var x = 1;</script></head><body>"
+    + "".join(f"<p class='MsoNormal'>Artículo {i}.&nbsp;El texto del artículo <b>{i}</b> de la norma.</p>" for i in range(2000))
+    + "</body></html>"
+)
+
+def _medir(nombre: str, texto: str, repeticiones: int):
+    anterior = min(timeit.repeat(lambda: limpiar_html_bs4(texto), number=repeticiones, repeat=3)) / repeticiones
+    nuevo = min(timeit.repeat(lambda: limpiar_html(texto), number=repeticiones, repeat=3)) / repeticiones
+    print(f"{nombre[:40]:<42}{anterior * 1e6:>12.1f}{nuevo * 1e6:>12.1f}{anterior / nuevo:>9.1f}x")
+
+def main():
+    print(f"{'entrada':<42}{'bs4 us':>12}{'nuevo us':>12}{'mejora':>10}")
+
+    for consulta in CONSULTAS:
+        _medir(f"consulta: {consulta}", consulta, 2000)
+
+    _medir(f"html sintetico ({len(HTML_SINTETICO) // 1024} KB)", HTML_SINTETICO, 20)
+
+    for path in sys.argv[1:]:
+        with open(path, encoding="cp1252", errors="ignore") as f:
+            _medir(path, f.read(), 20)
+
+if __name__ == "__main__":
+    main()
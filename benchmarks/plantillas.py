@@ -0,0 +1,68 @@
+# CPU por peticion para construir y serializar el cuerpo de regular_search:
+# dicts completos + json (implementacion anterior) vs fragmentos precompilados + orjson
+# Uso: python -m benchmarks.plantillas
+import copy
+import json
+import timeit
+import orjson
+from config import FACETA_AGGS, HIGHLIGHTER_CONFIG, regular_search_query
+from main import FACETA_AGGS_FRAGMENT, HIGHLIGHT_FRAGMENT, SOURCE_FRAGMENT
+from models import SearchFilters
+from utils import OrjsonSerializer, build_query
+
+CONSULTA = "constitución política de colombia"
+FILTROS = SearchFilters(document_type="Ley", not_include=["derogado"], must=["salud"])
+serializer = OrjsonSerializer()
+
+# Sin fragmentos, los campos de los multi_match se vuelven listas normales como antes
+_PLANTILLA = json.loads(orjson.dumps(regular_search_query("{q}")))
+
+def _query_anterior(search_query):
+    query = copy.deepcopy(_PLANTILLA)
+    for clausula in query["bool"]["should"]:
+        for tipo in clausula.values():
+            for campo, valor in tipo.items():
+                if isinstance(valor, dict):
+                    valor.update({k: search_query for k, v in valor.items() if v == "{q}"})
+                elif valor == "{q}":
+                    tipo[campo] = search_query
+    return query
+
+def cuerpo_anterior():
+    query = _query_anterior(CONSULTA)
+    build_query(query=query, filters=FILTROS)
+    return json.dumps({
+        "query": query,
+        "from": 0,
+        "size": 10,
+        "_source": {"excludes": ["embedding", "passages"]},
+        "highlight": HIGHLIGHTER_CONFIG,
+        "aggs": FACETA_AGGS,
+    }).encode("utf-8")
+
+def cuerpo_nuevo():
+    query = regular_search_query(CONSULTA)
+    build_query(query=query, filters=FILTROS)
+    return serializer.dumps({
+        "query": query,
+        "from": 0,
+        "size": 10,
+        "_source": SOURCE_FRAGMENT,
+        "highlight": HIGHLIGHT_FRAGMENT,
+        "aggs": FACETA_AGGS_FRAGMENT,
+    })
+
+def main():
+    # Ambos cuerpos deben ser equivalentes
+    assert json.loads(cuerpo_anterior()) == json.loads(cuerpo_nuevo())
+
+    n = 20000
+    anterior = min(timeit.repeat(cuerpo_anterior, number=n, repeat=5)) / n
+    nuevo = min(timeit.repeat(cuerpo_nuevo, number=n, repeat=5)) / n
+
+    print(f"anterior: {anterior * 1e6:.1f} us/peticion")
+    print(f"nuevo:    {nuevo * 1e6:.1f} us/peticion ({anterior / nuevo:.1f}x)")
+    print(f"a 500 req/s se ahorran {(anterior - nuevo) * 500 * 1000:.1f} ms de CPU por segundo")
+
+if __name__ == "__main__":
+    main()
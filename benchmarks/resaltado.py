@@ -0,0 +1,79 @@
+# Costo del resaltado segun HIGHLIGHT_MODE: tamaño del indice vs latencia de busquedas con highlight
+# Uso: python -m benchmarks.resaltado resultados/datos.jsonl --docs 5000
+import argparse
+import statistics
+import time
+from itertools import islice
+from elasticsearch import helpers
+from indexar_data import _read_documents
+from utils import get_es_client
+from config import highlight_mapping, highlighter_config, regular_search_query
+
+MODOS = ["analyze", "offsets", "fvh"]
+CONSULTAS = [
+    "constitución política",
+    "acción de tutela derechos fundamentales",
+    "ley 100 de 1993",
+    "régimen de seguridad social en salud",
+    "contratación estatal",
+]
+
+def _indexar(es, nombre: str, modo: str, documentos: list):
+    texto = {"type": "text", "analyzer": "spanish", **highlight_mapping(modo)}
+    es.indices.delete(index=nombre, ignore_unavailable=True)
+    es.indices.create(
+        index=nombre,
+        settings={"number_of_replicas": 0, "refresh_interval": "-1"},
+        mappings={"properties": {"body": texto, "Epigrafe": texto}}
+    )
+    helpers.bulk(es, (
+        {"_index": nombre, "body": d.get("body") or "", "Epigrafe": d.get("Epigrafe") or ""}
+        for d in documentos
+    ))
+    es.indices.refresh(index=nombre)
+    es.indices.forcemerge(index=nombre, max_num_segments=1)
+
+def _latencias(es, nombre: str, modo: str, repeticiones: int):
+    latencias = {"sin highlight": [], "con highlight": []}
+
+    for _ in range(repeticiones):
+        for consulta in CONSULTAS:
+            query = {"multi_match": {"query": consulta, "fields": ["body", "Epigrafe"]}}
+            latencias["sin highlight"].append(es.search(index=nombre, query=query, size=10, _source=False)["took"])
+            latencias["con highlight"].append(es.search(
+                index=nombre,
+                query=query,
+                size=10,
+                _source=False,
+                highlight={**highlighter_config(modo), "highlight_query": regular_search_query(consulta)},
+            )["took"])
+
+    return latencias
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    es = get_es_client()
+    documentos = list(islice(_read_documents(args.file), args.docs))
+
+    print(f"{'modo':<10}{'store MB':>10}{'p50 sin':>10}{'p50 con':>10}{'p95 con':>10}")
+    for modo in MODOS:
+        nombre = f"bench-resaltado-{modo}"
+        _indexar(es, nombre, modo, documentos)
+
+        store = es.indices.stats(index=nombre, metric="store")["_all"]["primaries"]["store"]["size_in_bytes"]
+        latencias = _latencias(es, nombre, modo, args.repeticiones)
+        con = latencias["con highlight"]
+        p95 = statistics.quantiles(con, n=20)[-1] if len(con) > 1 else con[0]
+
+        print(f"{modo:<10}{store / 2**20:>10.1f}{statistics.median(latencias['sin highlight']):>10.1f}{statistics.median(con):>10.1f}{p95:>10.1f}")
+        es.indices.delete(index=nombre)
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    main()
+    print(f"Tiempo total: {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,73 @@
+# Latencia de regular_search con y sin el enrutamiento de identificadores, repitiendo un log de consultas
+# Uso: python -m benchmarks.rutas benchmarks/consultas.jsonl --repeticiones 20
+import argparse
+import statistics
+import time
+import orjson
+from config import HIGHLIGHTER_CONFIG, INDEX_NAME, SOURCE_EXCLUDES, VALORES_AGGS, regular_search_query
+from consulta import EXACT_SORT, ValoresConocidos, exact_search_query
+from utils import get_es_client
+
+def _cargar_consultas(path: str) -> list:
+    with open(path, "rb") as f:
+        lineas = [orjson.loads(linea) for linea in f if linea.strip()]
+    # Del log de carga solo sirven las de regular_search, un archivo con solo {"query": ...} tambien vale
+    return [l["query"] for l in lineas if l.get("endpoint", "regular_search") == "regular_search" and l.get("query")]
+
+def _texto_completo(es, consulta: str) -> float:
+    return es.search(
+        index=INDEX_NAME,
+        query=regular_search_query(consulta),
+        size=10,
+        source_excludes=SOURCE_EXCLUDES,
+        highlight=HIGHLIGHTER_CONFIG,
+    )["took"]
+
+# Igual que regular_search: query de solo filtros y texto completo si no encuentra nada
+def _enrutada(es, consulta: str, valores: ValoresConocidos) -> tuple:
+    exact_query = exact_search_query(consulta, valores)
+    if exact_query is None:
+        return "full_text", _texto_completo(es, consulta)
+
+    respuesta = es.search(index=INDEX_NAME, query=exact_query, sort=EXACT_SORT, size=10, source_excludes=SOURCE_EXCLUDES)
+    if respuesta["hits"]["hits"]:
+        return "exact", respuesta["took"]
+    return "exact_fallback", respuesta["took"] + _texto_completo(es, consulta)
+
+def _p95(valores: list) -> float:
+    return statistics.quantiles(valores, n=20)[-1] if len(valores) > 1 else valores[0]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="Log de consultas JSONL")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    es = get_es_client()
+    consultas = _cargar_consultas(args.queries)
+    valores = ValoresConocidos.from_aggs(es.search(index=INDEX_NAME, size=0, aggs=VALORES_AGGS)["aggregations"])
+
+    por_ruta = {}
+    for _ in range(args.repeticiones):
+        for consulta in consultas:
+            ruta, took = _enrutada(es, consulta, valores)
+            medidas = por_ruta.setdefault(ruta, {"antes": [], "despues": []})
+            medidas["antes"].append(_texto_completo(es, consulta))
+            medidas["despues"].append(took)
+
+    print(f"{'ruta':<16}{'consultas':>10}{'p50 antes':>11}{'p50 ahora':>11}{'p95 antes':>11}{'p95 ahora':>11}")
+    for ruta, medidas in sorted(por_ruta.items()):
+        antes, despues = medidas["antes"], medidas["despues"]
+        print(
+            f"{ruta:<16}{len(antes) // args.repeticiones:>10}{statistics.median(antes):>11.1f}{statistics.median(despues):>11.1f}"
+            f"{_p95(antes):>11.1f}{_p95(despues):>11.1f}"
+        )
+
+    antes = [t for m in por_ruta.values() for t in m["antes"]]
+    despues = [t for m in por_ruta.values() for t in m["despues"]]
+    print(f"took promedio (ms): antes {statistics.mean(antes):.1f} | ahora {statistics.mean(despues):.1f}")
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    main()
+    print(f"Tiempo total: {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,92 @@
+# Compara modos de almacenamiento de vectores: tamaño del indice, memoria del HNSW, latencia y recall@k
+# Uso: python -m benchmarks.vectores resultados/datos.jsonl --docs 5000 --queries 200
+import argparse
+import statistics
+import time
+from itertools import islice
+import numpy as np
+from elasticsearch import helpers
+from embeddings import encode_batch, limpiar_html, split_passages, truncate_dims
+from indexar_data import _read_documents
+from utils import get_es_client
+from config import EMBEDDING_DIMS, HNSW_M, vector_mapping
+
+MODOS = [ # (nombre, tipo de indice, dims)
+    ("float32", "hnsw", EMBEDDING_DIMS),
+    ("int8", "int8_hnsw", EMBEDDING_DIMS),
+    ("int8-256d", "int8_hnsw", 256),
+]
+
+def _bytes_por_dim(tipo: str) -> float:
+    return {"hnsw": 4, "int8_hnsw": 1, "int4_hnsw": 0.5}[tipo]
+
+def _cargar(file, num_docs: int):
+    documentos = list(islice(_read_documents(file), num_docs))
+    textos = [(split_passages(limpiar_html(d["body"] or "")) or [d.get("title") or ""])[0] for d in documentos]
+    return documentos, encode_batch(textos)
+
+def _indexar(es, nombre: str, tipo: str, dims: int, vectores: np.ndarray):
+    es.indices.delete(index=nombre, ignore_unavailable=True)
+    es.indices.create(
+        index=nombre,
+        settings={"number_of_replicas": 0, "refresh_interval": "-1"},
+        mappings={"properties": {"embedding": vector_mapping(tipo, dims)}}
+    )
+    helpers.bulk(es, ({"_index": nombre, "_id": str(i), "embedding": v} for i, v in enumerate(truncate_dims(vectores, dims))))
+    es.indices.refresh(index=nombre)
+    es.indices.forcemerge(index=nombre, max_num_segments=1)
+
+def _recall(es, nombre: str, dims: int, vectores: np.ndarray, consultas: np.ndarray, k: int):
+    base = truncate_dims(vectores, EMBEDDING_DIMS)
+    latencias, recalls = [], []
+
+    for consulta in consultas:
+        # Vecinos exactos con los vectores completos como referencia
+        exactos = set(np.argsort(-(base @ consulta))[:k].astype(str))
+
+        respuesta = es.search(
+            index=nombre,
+            knn={"field": "embedding", "query_vector": truncate_dims(consulta, dims), "k": k, "num_candidates": k * 10},
+            size=k,
+            _source=False,
+        )
+        latencias.append(respuesta["took"])
+        encontrados = {hit["_id"] for hit in respuesta["hits"]["hits"]}
+        recalls.append(len(exactos & encontrados) / k)
+
+    return latencias, recalls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    es = get_es_client()
+    documentos, vectores = _cargar(args.file, args.docs)
+    # Los titulos sirven como consultas realistas
+    consultas = encode_batch([d.get("title") or "" for d in documentos[:args.queries]])
+
+    print(f"{'modo':<12}{'store MB':>10}{'hnsw MB*':>10}{'p50 ms':>8}{'p95 ms':>8}{'recall@' + str(args.k):>11}")
+    for modo, tipo, dims in MODOS:
+        nombre = f"bench-vectores-{modo}"
+        _indexar(es, nombre, tipo, dims, vectores)
+
+        store = es.indices.stats(index=nombre, metric="store")["_all"]["primaries"]["store"]["size_in_bytes"]
+        # Estimacion de memoria fuera del heap segun la guia de tuning de knn de elastic
+        hnsw = len(vectores) * (dims * _bytes_por_dim(tipo) + 4 * HNSW_M)
+
+        latencias, recalls = _recall(es, nombre, dims, vectores, consultas, args.k)
+        p95 = statistics.quantiles(latencias, n=20)[-1] if len(latencias) > 1 else latencias[0]
+
+        print(f"{modo:<12}{store / 2**20:>10.1f}{hnsw / 2**20:>10.1f}{statistics.median(latencias):>8.1f}{p95:>8.1f}{statistics.mean(recalls):>11.3f}")
+        es.indices.delete(index=nombre)
+
+    print("* estimado: vectores * (dims * bytes por dim + 4 * m)")
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    main()
+    print(f"Tiempo total: {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable, Optional
+import orjson
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+# Redis es opcional, sin el paquete el cache de resultados vive en la memoria de cada worker
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger("buscador.cache")
+
+# Cache LRU acotado por tamaño y con expiracion por TTL, seguro entre hilos
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expira, valor = item
+            if expira and expira < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return valor
+
+    def set(self, key: Hashable, valor: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl else 0.0
+
+        with self._lock:
+            self._data[key] = (expira, valor)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# Identifica la version del indice detras del alias, se usa como parte de las llaves de cache.
+# Ademas del nombre del indice lleva su _meta.generation, que cambian las escrituras sin cambio de alias
+# (ingesta por api, corridas incrementales de indexar_data): todos los workers ven el mismo valor
+class IndexGeneration:
+    def __init__(self, alias: str, check_interval: float = 5):
+        self.alias = alias
+        self.check_interval = check_interval
+        self._generation = alias
+        self._checked: Optional[float] = None
+
+    async def get(self, es: AsyncElasticsearch) -> str:
+        if self._checked is None or time.monotonic() - self._checked > self.check_interval:
+            try:
+                mappings = await es.indices.get_mapping(index=self.alias)
+                self._generation = ",".join(
+                    f"{nombre}#{datos['mappings'].get('_meta', {}).get('generation', '')}" for nombre, datos in sorted(mappings.items())
+                )
+            except NotFoundError:
+                self._generation = self.alias # Todavia no hay indice
+            self._checked = time.monotonic()
+
+        return self._generation
+
+    # El proceso que escribio no espera check_interval para ver la generacion nueva
+    def invalidate(self) -> None:
+        self._checked = None
+
+# Cache de respuestas completas, en memoria o en un redis compartido entre workers.
+# Las peticiones iguales que llegan mientras se calcula una respuesta esperan esa misma llamada (single-flight)
+class ResultCache:
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, redis_url: str = "", prefix: str = "buscador:resultados:"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._local = LRUCache(max_size=max_size, ttl=ttl)
+        self._redis = None
+        self._en_vuelo: "dict[str, asyncio.Future]" = {}
+
+        if redis_url:
+            if aioredis is None:
+                logger.warning("RESULT_CACHE_REDIS_URL definido pero el paquete redis no esta instalado, se usa el cache en memoria")
+            else:
+                self._redis = aioredis.from_url(redis_url)
+
+    @staticmethod
+    def key(*partes) -> str:
+        return hashlib.sha1(orjson.dumps(partes)).hexdigest()
+
+    async def get(self, key: str) -> Any:
+        if self._redis is None:
+            return self._local.get(key)
+
+        try:
+            valor = await self._redis.get(self.prefix + key)
+        except Exception as e: # Si redis no responde se sigue sin cache
+            logger.warning("Error leyendo el cache de resultados: %s", e)
+            valor = None
+
+        if valor is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return orjson.loads(valor)
+
+    async def set(self, key: str, valor: Any) -> None:
+        if self._redis is None:
+            self._local.set(key, valor)
+            return
+
+        try:
+            await self._redis.set(self.prefix + key, orjson.dumps(valor), ex=int(self.ttl) if self.ttl else None)
+        except Exception as e:
+            logger.warning("Error guardando en el cache de resultados: %s", e)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        valor = await self.get(key)
+        if valor is not None:
+            return valor
+
+        tarea = self._en_vuelo.get(key)
+        if tarea is None:
+            # Tarea aparte: si el cliente que la inicio se desconecta, las demas peticiones no pierden el resultado
+            tarea = asyncio.ensure_future(self._compute(key, compute))
+            self._en_vuelo[key] = tarea
+            tarea.add_done_callback(lambda _: self._en_vuelo.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(tarea)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        valor = await compute()
+        await self.set(key, valor)
+        return valor
+
+    async def clear(self) -> None:
+        self._local.clear()
+        if self._redis is None:
+            return
+
+        try:
+            async for llave in self._redis.scan_iter(match=self.prefix + "*"):
+                await self._redis.delete(llave)
+        except Exception as e:
+            logger.warning("Error vaciando el cache de resultados: %s", e)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    def stats(self) -> dict:
+        if self._redis is None:
+            return {**self._local.stats(), "coalesced": self.coalesced}
+
+        total = self.hits + self.misses
+        return {
+            "size": None, # Vive en redis
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,4 +1,53 @@
-INDEX_NAME = "prueba" # Nombre del indice en elasticsearch
+import os
+import orjson
+
+ES_HOST = os.getenv("ES_HOST", "http://localhost:9200") # Direccion del cluster de elasticsearch
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "25")) # Tamaño del pool de conexiones por nodo
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10")) # Segundos antes de abortar una peticion
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "2")) # Reintentos ante errores de conexion / timeouts
+ES_RETRY_ON_STATUS = (429, 502, 503, 504) # Codigos HTTP que vale la pena reintentar
+
+INDEX_NAME = "prueba" # Alias que consulta la api, apunta al indice versionado vigente (prueba-<timestamp>)
+INDEX_KEEP_VERSIONS = 2 # Versiones del indice que se conservan para poder hacer rollback
+INDEX_MIN_DOCS_RATIO = 0.9 # Una version nueva con menos documentos que esta fraccion de la vigente no se publica sin --force
+INDEX_SETTINGS = { # Settings del indice una vez termina la indexacion
+    "number_of_replicas": int(os.getenv("INDEX_REPLICAS", "1")),
+    "refresh_interval": "1s",
+}
+BULK_INDEX_SETTINGS = { # Settings mientras se indexa: sin refresh ni replicas, se restauran al terminar
+    "number_of_replicas": 0,
+    "refresh_interval": "-1",
+}
+EMBEDDING_MODEL_DIMS = 384 # Dimensiones que produce all-MiniLM-L6-v2
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", str(EMBEDDING_MODEL_DIMS))) # Menos dims = se truncan (estilo Matryoshka) y se renormalizan
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "int8_hnsw") # hnsw (float32) | int8_hnsw (~4x menos memoria) | int4_hnsw (elastic >= 8.15)
+HNSW_M = int(os.getenv("HNSW_M", "16")) # Vecinos por nodo del grafo, mas = mejor recall y mas memoria
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100")) # Candidatos al construir el grafo, mas = mejor recall e indexacion mas lenta
+
+HIGHLIGHT_MODE = os.getenv("HIGHLIGHT_MODE", "offsets") # offsets (postings con offsets) | fvh (term vectors) | analyze (re-analiza el texto, sin costo en disco)
+HIGHLIGHT_MAX_ANALYZED_OFFSET = int(os.getenv("HIGHLIGHT_MAX_ANALYZED_OFFSET", "100000")) # Caracteres que se re-analizan por hit cuando el indice no tiene offsets
+
+# Lo que se guarda en el indice para resaltar sin re-analizar, cambiarlo requiere reindexar
+def highlight_mapping(mode=None):
+    return {
+        "offsets": {"index_options": "offsets"},
+        "fvh": {"term_vector": "with_positions_offsets"},
+        "analyze": {},
+    }[mode or HIGHLIGHT_MODE]
+
+def vector_mapping(index_type=None, dims=None):
+    return {
+        "type": "dense_vector",
+        "dims": dims or EMBEDDING_DIMS,
+        "index": True,
+        "similarity": "cosine",
+        "index_options": {
+            "type": index_type or VECTOR_INDEX_TYPE,
+            "m": HNSW_M,
+            "ef_construction": HNSW_EF_CONSTRUCTION
+        }
+    }
+
 INDEX_MAPPING = { # Mapeo de campos del indice
                     "title": {
                         "type": "search_as_you_type",
@@ -6,11 +55,13 @@ INDEX_MAPPING = { # Mapeo de campos del indice
                     },
                     "body": {
                         "type": "text",
-                        "analyzer": "spanish"
+                        "analyzer": "spanish",
+                        **highlight_mapping()
                     },
                     "Epigrafe": {
                         "type": "text",
-                        "analyzer": "spanish"
+                        "analyzer": "spanish",
+                        **highlight_mapping()
                     },
                     "Nombre": {
                         "type": "text",
@@ -57,17 +108,105 @@ INDEX_MAPPING = { # Mapeo de campos del indice
                     "doc-name": {
                         "type": "keyword"
                     },
-                    "embedding": {
-                        "type": "dense_vector",
-                        "dims": 384,
-                        "index": True,
-                        "similarity": "cosine"
+                    "content_hash": { # Hash del documento y de la config de embeddings, para saltar los que no cambiaron
+                        "type": "keyword",
+                        "index": False
+                    },
+                    "passages": { # Fragmentos del body con su propio vector, el modelo trunca textos largos
+                        "type": "nested",
+                        "properties": {
+                            "text": {
+                                "type": "text",
+                                "index": False
+                            },
+                            "vector": vector_mapping()
+                        }
                     }
                 }
+SOURCE_EXCLUDES = ["embedding", "passages"] # Campos pesados que no se devuelven en las busquedas (embedding solo existe en versiones viejas del indice)
+LIST_SOURCE_INCLUDES = ["title", "Numero", "Tipo", "Entidad", "Year", "doc-name"] # Campos de la vista "list", sin el body
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1000")) # Respuestas mas pequeñas (bytes) se envian sin comprimir
+PASSAGE_WORDS = 120 # Palabras por fragmento, all-MiniLM-L6-v2 trunca a 256 tokens
+PASSAGE_OVERLAP = 30 # Palabras que comparten fragmentos consecutivos para no cortar ideas
+EMBEDDING_MODEL = "all-MiniLM-L6-v2" # Modelo de sentence-transformers (nombre en el hub)
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH") # Carpeta local con el modelo, evita descargarlo al arrancar
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch") # torch | onnx | onnx-int8 (recomendado en CPU)
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx") # Archivo del modelo cuantizado dentro del modelo
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) # Hilos de inferencia, 0 = los que decida el backend
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "1") == "1" # Cargar el modelo al iniciar la api y no en la primera consulta
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")) # Consultas distintas guardadas en memoria (~1.5KB c/u)
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "3600")) # Segundos que vive un embedding en cache
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5")) # Ventana para agrupar consultas concurrentes
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32")) # Tamaño maximo de un batch de consultas
+AGGS_CACHE_SIZE = 2048 # Respuestas de agregaciones (filtros / facetas) guardadas en memoria
+AGGS_CACHE_TTL = 600 # Segundos, respaldo por si el indice cambia sin cambiar el alias
+GENERATION_CHECK_INTERVAL = 5 # Segundos entre consultas del indice detras del alias
+SELECTS_MAX_AGE = 300 # Cache-Control max-age de /search/filters
+SUGGEST_SIZE = 8 # Sugerencias por defecto en el autocompletado
+SUGGEST_MIN_CHARS = 2 # Con menos caracteres no se consulta elastic
+SUGGEST_CACHE_SIZE = 5000 # Prefijos guardados en memoria, los mas usados se repiten mucho
+SUGGEST_CACHE_TTL = 300
+SUGGEST_TIMEOUT = 1.0 # Segundos, una sugerencia tarde ya no le sirve al usuario
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "1") == "1" # Consultas tipo identificador ("1437", "ley 100 de 1993") usan un query de solo filtros
+QUERY_ROUTING_MAX_VALUES = 5000 # Valores de Tipo/Entidad que se cargan para reconocerlos en la consulta
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "0")) # Tope de limit por pagina en SearchBody, 0 = sin tope
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2048")) # Respuestas de regular_search guardadas en memoria
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "60")) # Segundos, respaldo por si el indice cambia sin cambiar el alias
+RESULT_CACHE_REDIS_URL = os.getenv("RESULT_CACHE_REDIS_URL", "") # redis://... para compartir el cache entre workers (pip install redis)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500")) # Peticiones mas lentas se registran con su query
+ES_PROFILE_ENABLED = os.getenv("ES_PROFILE_ENABLED", "0") == "1" # Permite pedir profile: true en SearchBody (solo debug)
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "0") == "1" # Spans de OpenTelemetry por etapa, si el paquete esta instalado
+PIT_KEEP_ALIVE = "5m" # Tiempo que elastic mantiene vivo el point-in-time entre paginas
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "2")) # Batches codificandose al mismo tiempo por proceso
+EMBEDDING_MAX_QUEUE = int(os.getenv("EMBEDDING_MAX_QUEUE", "256")) # Consultas esperando embedding antes de responder 503
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "5")) # Segundos maximos para calcular un batch
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET") # Socket unix del servicio de embeddings, sin valor se calcula en el proceso
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))) # Procesos del servicio, cada uno con una copia del modelo
 MIN_SCORE_THRESHOLD = 0.5 # Puntaje minimo para considerar un resultado relevante
 MAX_BULK_SIZE = 5 * 1024 * 1024  # 5 MB / El limite default de transacciones http de elastic es 100mb pero es recomendable enviar chunks mas pequeños para que la conexión no muera
+BULK_CHUNK_SIZE = 500 # Documentos maximos por peticion bulk (el que se alcance primero entre este y MAX_BULK_SIZE)
+BULK_THREADS = int(os.getenv("BULK_THREADS", "4")) # Peticiones bulk concurrentes durante la indexacion
+BULK_QUEUE_SIZE = 4 # Chunks pendientes antes de frenar la lectura/embedding (backpressure)
+BULK_MAX_RETRIES = 5 # Reintentos para documentos rechazados con 429
+EMBEDDING_BATCH_SIZE = 64 # Documentos que se codifican juntos en un llamado a model.encode
+INGEST_TOKEN = os.getenv("INGEST_TOKEN", "") # Bearer token de /api/v1/documents (POST/DELETE), vacio = ingesta deshabilitada
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "100")) # Trabajos de indexacion en cola antes de responder 503
+INGEST_BATCH_SIZE = 64 # Documentos de un trabajo que se codifican y envian juntos
+INGEST_MAX_DOCS = 5000 # Documentos por peticion, cargas mas grandes se hacen con indexar_data.py
+INGEST_JOBS_KEPT = 500 # Estados de trabajos terminados que se conservan para consultarlos
 
 
+PASSAGE_INNER_HITS = { # Fragmento que mas se parece a la consulta
+    "size": 1,
+    "_source": ["passages.text"]
+}
+
+# Serializa una sola vez una parte constante del cuerpo de las peticiones, orjson la copia tal cual en cada
+# busqueda. Solo para partes que nadie lee ni modifica despues (el resultado ya no es un dict)
+def precompile(obj) -> orjson.Fragment:
+    return orjson.Fragment(orjson.dumps(obj))
+
+_CROSS_FIELDS = precompile([
+    "title^6",
+    "Nombre^4",
+    "Numero.text^4",
+    "Tipo^4",
+    "Entidad^4",
+    "Epigrafe^2",
+    "body"
+])
+_PREFIX_FIELDS = precompile([
+    "title^4",
+    "title._2gram",
+    "title._3gram"
+])
+
+_SUGGEST_FIELDS = precompile([
+    "title",
+    "title._2gram",
+    "title._3gram"
+])
+
 # Querys para busquedas
 def regular_search_query(search_query):
     return {
@@ -108,15 +247,7 @@ def regular_search_query(search_query):
                 {
                     "multi_match": {
                         "query": search_query,
-                        "fields": [
-                            "title^6",
-                            "Nombre^4",
-                            "Numero.text^4",
-                            "Tipo^4",
-                            "Entidad^4",
-                            "Epigrafe^2",
-                            "body"
-                        ],
+                        "fields": _CROSS_FIELDS,
                         "operator": "or",
                         "type": "cross_fields",
                         "minimum_should_match": "25%"
@@ -126,11 +257,7 @@ def regular_search_query(search_query):
                     "multi_match": {
                         "query": search_query,
                         "type": "bool_prefix",
-                        "fields": [
-                            "title^4",
-                            "title._2gram",
-                            "title._3gram"
-                        ],
+                        "fields": _PREFIX_FIELDS,
                         "fuzziness": "AUTO"
                     }
                 }
@@ -139,15 +266,33 @@ def regular_search_query(search_query):
         }
     }
 
+# Autocompletado sobre los subcampos del search_as_you_type de title
+def suggest_query(prefix):
+    return {
+        "multi_match": {
+            "query": prefix,
+            "type": "bool_prefix",
+            "fields": _SUGGEST_FIELDS
+        }
+    }
+
 def semantic_search_query(search_query, embedding_vector):
     semantic_query = regular_search_query(search_query)
     
+    # knn sobre los fragmentos, el mejor fragmento de cada documento se devuelve como snippet
     semantic_query["bool"]["should"].append(
         {
-            "knn": {
-                "field": "embedding",
-                "query_vector": embedding_vector,
-                "num_candidates": 150,
+            "nested": {
+                "path": "passages",
+                "score_mode": "max",
+                "query": {
+                    "knn": {
+                        "field": "passages.vector",
+                        "query_vector": embedding_vector,
+                        "num_candidates": 150
+                    }
+                },
+                "inner_hits": PASSAGE_INNER_HITS,
                 "boost": 2.0
             }
         }
@@ -157,24 +302,111 @@ def semantic_search_query(search_query, embedding_vector):
     
     return semantic_query
     
-HIGHLIGHTER_CONFIG = {
-                    "pre_tags": ["<mark class='es-highlight'>"],
-                    "post_tags": ["</mark>"],
-                    "max_analyzed_offset": 1000000,
-                    "fields": {
-                        "Epigrafe": {
-                            "fragment_size": 250,
-                            "number_of_fragments": 1
-                        },
-                        "body": {
-                            "max_analyzed_offset": 1000000,
-                            "fragment_size": 250,
-                            "number_of_fragments": 1
+# Agregaciones para los selects de filtros
+SELECTS_AGGS = {
+    "tipos": {
+        "terms": {
+            "field": "Tipo.keyword",
+            "order": {"_key": "asc"},
+            "min_doc_count": 1
+        },
+    },
+    "entidades": {
+        "terms": {
+            "field": "Entidad.keyword",
+            "order": {"_key": "asc"},
+            "min_doc_count": 1
+        }
+    }
+}
+
+# Todos los valores de Tipo/Entidad, para reconocer consultas que son exactamente uno de ellos
+VALORES_AGGS = {
+    nombre: {"terms": {"field": campo, "size": QUERY_ROUTING_MAX_VALUES}}
+    for nombre, campo in (("tipos", "Tipo.keyword"), ("entidades", "Entidad.keyword"))
+}
+
+# Agregaciones tipo -> entidad -> año para construir la faceta
+FACETA_AGGS = {
+    "tipo": {
+        "terms": {
+            "field": "Tipo.keyword",
+            "order": {"_key": "asc"},
+            "min_doc_count": 1
+        },
+        "aggs": {
+            "entidad": {
+                "terms": {
+                    "field": "Entidad.keyword",
+                    "order": {"_key": "asc"},
+                    "min_doc_count": 1
+                },
+                "aggs": {
+                    "year": {
+                        "date_histogram": {
+                            "field": "Year",
+                            "calendar_interval": "year",
+                            "format": "yyyy",
+                            "min_doc_count": 1
                         }
                     }
                 }
+            }
+        }
+    }
+}
+
+# knn de primer nivel para la busqueda hibrida, los filtros se aplican durante la busqueda del HNSW
+def knn_search_query(embedding_vector, k, num_candidates, filter_query=None, boost=1.0):
+    knn = {
+        "field": "passages.vector",
+        "query_vector": embedding_vector,
+        "k": k,
+        "num_candidates": max(num_candidates, k),
+        "inner_hits": PASSAGE_INNER_HITS,
+        "boost": boost
+    }
+    if filter_query:
+        knn["filter"] = filter_query
+
+    return knn
+
+# fvh usa los term vectors, unified toma los offsets del postings si existen y si no re-analiza (hasta el tope)
+def highlighter_config(mode=None, number_of_fragments=1):
+    mode = mode or HIGHLIGHT_MODE
+    config = {
+        "type": "fvh" if mode == "fvh" else "unified",
+        "pre_tags": ["<mark class='es-highlight'>"],
+        "post_tags": ["</mark>"],
+        "fields": {
+            "Epigrafe": {
+                "fragment_size": 250,
+                "number_of_fragments": 1
+            },
+            "body": {
+                "fragment_size": 250,
+                "number_of_fragments": number_of_fragments
+            }
+        },
+        # En todos los modos: una version sin offsets (anterior al mapping o alcanzable con --rollback) re-analiza
+        # el body y sin el tope falla con los textos mas largos que index.highlight.max_analyzed_offset
+        "max_analyzed_offset": HIGHLIGHT_MAX_ANALYZED_OFFSET
+    }
+    return config
+
+HIGHLIGHTER_CONFIG = highlighter_config()
+
+# En las busquedas semanticas (y con lazy_highlight) no se resalta el body, solo el epigrafe
+SEMANTIC_HIGHLIGHTER_CONFIG = {
+                    "type": HIGHLIGHTER_CONFIG["type"],
+                    "pre_tags": HIGHLIGHTER_CONFIG["pre_tags"],
+                    "post_tags": HIGHLIGHTER_CONFIG["post_tags"],
+                    "fields": {
+                        "Epigrafe": HIGHLIGHTER_CONFIG["fields"]["Epigrafe"]
+                    }
+                }
 
-JERARQUIA_FACETA = { # Dejar el contenido de cada una en minúsculas para mejor coincidencia
+JERARQUIA_FACETA = { # Prefijos de Tipo por grupo, en el orden en que se muestran (se comparan sin tildes ni mayusculas)
     "Normativa": [ 
         "constituciones",
         "actos legislativos",
@@ -191,6 +423,5 @@ JERARQUIA_FACETA = { # Dejar el contenido de cada una en minúsculas para mejor
     ]
 }
 
-LOOKUP_FACETA = {# Se usa un set al momento de comparar ya que es mucho mas eficiente que las listas | No se puede usar porque hay matches incompletos :(
-    k: set(v) for k, v in JERARQUIA_FACETA.items()
-}
+FACETA_CONFIG_FILE = os.getenv("FACETA_CONFIG_FILE", "") # json con la misma forma que JERARQUIA_FACETA, se recarga sin reiniciar
+FACETA_CHECK_INTERVAL = 5 # Segundos entre revisiones del mtime de FACETA_CONFIG_FILE
@@ -0,0 +1,56 @@
+import re
+from typing import Optional
+from faceta import normalizar_clave
+
+# "1437", "no. 1437", "n° 1437"
+_NUMERO = re.compile(r"^(?:n[o°º]?\.?\s*)?(\d{1,6})$")
+# "ley 100 de 1993", "decreto 1072 del 2015", "acuerdo no. 5"
+_NORMA = re.compile(r"^(?P<tipo>[a-z][a-z ]*?)\s+(?:n[o°º]?\.?\s*)?(?P<numero>\d{1,6})(?:\s+(?:de|del)\s+(?P<year>\d{4}))?$")
+
+# Orden de la ruta exacta: la norma mas reciente primero y doc-name para que el orden sea estable entre paginas
+EXACT_SORT = [{"Year": {"order": "desc", "missing": "_last"}}, {"doc-name": "asc"}]
+
+# Valores de Tipo/Entidad del indice, normalizados para compararlos con la consulta
+class ValoresConocidos:
+    def __init__(self, tipos: list, entidades: list):
+        self.tipos = {normalizar_clave(tipo): tipo for tipo in tipos}
+        self.entidades = {normalizar_clave(entidad): entidad for entidad in entidades}
+
+    @classmethod
+    def from_aggs(cls, aggs: dict) -> "ValoresConocidos":
+        return cls(
+            [bucket["key"] for bucket in aggs.get("tipos", {}).get("buckets", [])],
+            [bucket["key"] for bucket in aggs.get("entidades", {}).get("buckets", [])],
+        )
+
+    # "ley" -> ["Leyes"], el usuario suele escribir el tipo en singular
+    def tipos_con_prefijo(self, prefijo: str) -> list:
+        return [tipo for clave, tipo in self.tipos.items() if clave.startswith(prefijo)]
+
+# Query liviano (solo filtros, sin analisis de texto ni fuzziness) si la consulta es un identificador, si no None
+def exact_search_query(search_query: str, valores: ValoresConocidos) -> Optional[dict]:
+    texto = normalizar_clave(search_query)
+
+    numero = _NUMERO.match(texto)
+    if numero:
+        return {"bool": {"filter": [{"term": {"Numero": numero.group(1)}}]}}
+
+    norma = _NORMA.match(texto)
+    if norma:
+        tipos = valores.tipos_con_prefijo(norma.group("tipo"))
+        if tipos:
+            filtros = [
+                {"term": {"Numero": norma.group("numero")}},
+                {"terms": {"Tipo.keyword": tipos}},
+            ]
+            if norma.group("year"):
+                filtros.append({"term": {"Year": norma.group("year")}})
+            return {"bool": {"filter": filtros}}
+
+    if texto in valores.tipos:
+        return {"bool": {"filter": [{"term": {"Tipo.keyword": valores.tipos[texto]}}]}}
+
+    if texto in valores.entidades:
+        return {"bool": {"filter": [{"term": {"Entidad.keyword": valores.entidades[texto]}}]}}
+
+    return None
@@ -0,0 +1,84 @@
+# Servicio de embeddings compartido por todos los workers de la api a traves de un socket unix.
+# Mantiene EMBEDDING_WORKERS procesos con una copia del modelo cada uno, en vez de una copia por worker de uvicorn.
+# Uso: EMBEDDING_SERVICE_SOCKET=/tmp/embeddings.sock python embedding_service.py
+import asyncio
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import EMBEDDING_SERVICE_SOCKET, EMBEDDING_THREADS, EMBEDDING_TIMEOUT, EMBEDDING_WORKERS
+from embeddings import BatchEncoder, encode_batch, get_model
+
+# Cada mensaje va precedido por su longitud (4 bytes, big endian)
+_HEADER = struct.Struct("!I")
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return await reader.readexactly(size)
+
+def write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+# Cliente: peticion = lista JSON de textos | respuesta = b"V" + float32 (n, dims) o b"E" + mensaje de error
+async def remote_encode_batch(textos: list) -> np.ndarray:
+    async def _request():
+        reader, writer = await asyncio.open_unix_connection(EMBEDDING_SERVICE_SOCKET)
+        try:
+            write_frame(writer, json.dumps(textos, ensure_ascii=False).encode("utf-8"))
+            await writer.drain()
+            return await read_frame(reader)
+        finally:
+            writer.close()
+
+    respuesta = await asyncio.wait_for(_request(), EMBEDDING_TIMEOUT)
+    if respuesta[:1] == b"E":
+        raise RuntimeError(f"Servicio de embeddings: {respuesta[1:].decode('utf-8')}")
+
+    return np.frombuffer(respuesta[1:], dtype=np.float32).reshape(len(textos), -1)
+
+def _init_worker(threads: int):
+    get_model(threads) # Cada proceso carga el modelo una sola vez al arrancar
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, encoder: BatchEncoder):
+    try:
+        while True:
+            try:
+                payload = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+
+            try:
+                textos = json.loads(payload)
+                # Las peticiones de todos los clientes se mezclan en los mismos batches
+                vectores = await asyncio.gather(*(encoder.encode(texto) for texto in textos))
+                datos = np.stack(vectores).astype(np.float32).tobytes() if vectores else b""
+                write_frame(writer, b"V" + datos)
+            except Exception as e:
+                write_frame(writer, b"E" + str(e).encode("utf-8"))
+
+            await writer.drain()
+    finally:
+        writer.close()
+
+async def serve(path: str = EMBEDDING_SERVICE_SOCKET, workers: int = EMBEDDING_WORKERS):
+    if not path:
+        raise ValueError("Falta EMBEDDING_SERVICE_SOCKET")
+
+    # Sin EMBEDDING_THREADS cada backend usaria todos los nucleos en cada proceso, se reparten entre los procesos
+    threads = EMBEDDING_THREADS or max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        # Un batch en vuelo por proceso, el resto espera en la cola acotada del encoder
+        encoder = BatchEncoder(encode_batch, executor=pool, max_concurrency=workers)
+
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(lambda r, w: _handle(r, w, encoder), path=path)
+
+        print(f"Servicio de embeddings escuchando en {path} con {workers} procesos de {threads} hilos")
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -1,16 +1,236 @@
-from sentence_transformers import SentenceTransformer
-import torch
-from bs4 import BeautifulSoup
+import asyncio
+import sys
+from threading import Lock
+import numpy as np
+from cache import LRUCache
+from texto import limpiar_html
+from config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_WINDOW_MS,
+    EMBEDDING_DIMS,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    EMBEDDING_MAX_BATCH,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_QUEUE,
+    EMBEDDING_MODEL,
+    EMBEDDING_MODEL_PATH,
+    EMBEDDING_ONNX_FILE,
+    EMBEDDING_SERVICE_SOCKET,
+    EMBEDDING_THREADS,
+    EMBEDDING_TIMEOUT,
+    PASSAGE_OVERLAP,
+    PASSAGE_WORDS,
+)
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = SentenceTransformer("all-MiniLM-L6-v2").to(device)
+_model = None
+_model_lock = Lock()
 
-def limpiar_html(texto):
-    soup = BeautifulSoup(texto, "html.parser")
-    return soup.get_text(separator=" ")
+# Carga el modelo segun EMBEDDING_BACKEND, torch / sentence_transformers solo se importan aqui
+def _load_model(threads: int = EMBEDDING_THREADS):
+    from sentence_transformers import SentenceTransformer
 
-def get_embedding(texto):
-    texto_limpio = limpiar_html(texto)
+    nombre = EMBEDDING_MODEL_PATH or EMBEDDING_MODEL # Una ruta local permite arrancar sin internet
 
-    embedding = model.encode(texto_limpio)
-    return embedding.tolist()
\ No newline at end of file
+    if EMBEDDING_BACKEND == "torch":
+        import torch
+
+        if threads:
+            torch.set_num_threads(threads)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        return SentenceTransformer(nombre, device=device)
+
+    if EMBEDDING_BACKEND not in ("onnx", "onnx-int8"):
+        raise ValueError(f"EMBEDDING_BACKEND desconocido: {EMBEDDING_BACKEND}")
+
+    import onnxruntime
+
+    opciones = onnxruntime.SessionOptions()
+    if threads:
+        opciones.intra_op_num_threads = threads
+
+    model_kwargs = {"provider": "CPUExecutionProvider", "session_options": opciones}
+    if EMBEDDING_BACKEND == "onnx-int8":
+        model_kwargs["file_name"] = EMBEDDING_ONNX_FILE
+
+    return SentenceTransformer(nombre, backend="onnx", model_kwargs=model_kwargs)
+
+# El modelo se carga la primera vez que se necesita, importar este modulo no cuesta nada
+def get_model(threads: int = EMBEDDING_THREADS):
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model(threads) # threads solo aplica a la primera carga
+    return _model
+
+# Carga el modelo y hace un encode de prueba para que la primera consulta real no pague el arranque
+def warmup():
+    encode_batch(["warmup"])
+
+# Exporta el modelo a ONNX con cuantizacion int8 dinamica en una carpeta local (EMBEDDING_MODEL_PATH)
+def export_onnx(destino: str, config: str = "avx512_vnni"):
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(EMBEDDING_MODEL, backend="onnx")
+    model.save(destino)
+    export_dynamic_quantized_onnx_model(model, config, destino)
+    print(f"Modelo exportado en {destino}, usar EMBEDDING_ONNX_FILE=onnx/model_qint8_{config}.onnx")
+
+# Codifica varios textos en un solo llamado al modelo, devuelve una matriz float32 (n, EMBEDDING_DIMS)
+def encode_batch(textos: list) -> np.ndarray:
+    vectores = get_model().encode(textos, convert_to_numpy=True).astype(np.float32, copy=False)
+    return truncate_dims(vectores)
+
+# Se quedan las primeras dims y se renormaliza para que la similitud coseno siga siendo comparable
+def truncate_dims(vectores: np.ndarray, dims: int = EMBEDDING_DIMS) -> np.ndarray:
+    if vectores.shape[-1] <= dims:
+        return vectores
+
+    vectores = vectores[..., :dims]
+    normas = np.linalg.norm(vectores, axis=-1, keepdims=True)
+    return vectores / np.where(normas == 0, 1, normas)
+
+# Divide un texto largo en fragmentos de palabras que se solapan
+def split_passages(texto: str, size: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP) -> list:
+    palabras = texto.split()
+    if len(palabras) <= size:
+        return [" ".join(palabras)] if palabras else []
+
+    paso = size - overlap
+    return [" ".join(palabras[i:i + size]) for i in range(0, len(palabras) - overlap, paso)]
+
+class EncoderBusyError(RuntimeError):
+    pass
+
+# Agrupa las peticiones concurrentes que llegan dentro de una ventana de tiempo en un solo batch
+class BatchEncoder:
+    def __init__(
+        self,
+        encode=encode_batch,
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_batch: int = EMBEDDING_MAX_BATCH,
+        executor=None,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        max_queue: int = EMBEDDING_MAX_QUEUE,
+        timeout: float = EMBEDDING_TIMEOUT,
+    ):
+        self._encode = encode # Funcion sincrona (corre en executor) o corutina (p.ej. el servicio remoto)
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.executor = executor # None = pool de hilos del event loop
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency) # Batches codificandose al mismo tiempo
+        self._waiting = 0
+        self._pending: list = []
+        self._timer = None
+        self._tasks: set = set()
+
+    async def encode(self, texto: str) -> np.ndarray:
+        # Cola acotada: si el encoder no da abasto se rechaza en vez de acumular latencia
+        if self._waiting >= self.max_queue:
+            raise EncoderBusyError("Demasiadas consultas esperando embedding")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texto, future))
+        self._waiting += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        try:
+            return await future
+        finally:
+            self._waiting -= 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        lote, self._pending = self._pending, []
+        if not lote:
+            return
+
+        # Se guarda la referencia para que el task no sea recolectado antes de terminar
+        task = asyncio.ensure_future(self._run(lote))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _start_encode(self, textos: list) -> asyncio.Future:
+        if asyncio.iscoroutinefunction(self._encode):
+            return asyncio.ensure_future(self._encode(textos))
+        # El encode corre fuera del event loop (hilo o proceso) para no bloquearlo
+        return asyncio.get_running_loop().run_in_executor(self.executor, self._encode, textos)
+
+    def _release(self, trabajo: asyncio.Future):
+        self._semaphore.release()
+        if not trabajo.cancelled():
+            trabajo.exception() # Si ya vencio el timeout nadie mas lee el error
+
+    async def _run(self, lote: list):
+        # Textos repetidos dentro del mismo batch se codifican una sola vez
+        textos = list(dict.fromkeys(texto for texto, _ in lote))
+
+        try:
+            await self._semaphore.acquire()
+            # El timeout no detiene el hilo/proceso que esta codificando: el cupo se libera cuando termina de verdad,
+            # asi max_concurrency sigue acotando el trabajo real aunque se venzan los timeouts
+            try:
+                trabajo = self._start_encode(textos)
+            except BaseException:
+                self._semaphore.release()
+                raise
+            trabajo.add_done_callback(self._release)
+            vectores = await asyncio.wait_for(asyncio.shield(trabajo), self.timeout)
+        except Exception as e:
+            for _, future in lote:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Copia de cada fila: una vista mantendria viva la matriz del batch completo mientras siga en el cache
+        por_texto = {texto: np.array(vector) for texto, vector in zip(textos, vectores)}
+        for texto, future in lote:
+            if not future.done():
+                future.set_result(por_texto[texto])
+
+# Normaliza la consulta para que variaciones triviales compartan la misma entrada de cache
+def normalizar_consulta(texto: str) -> str:
+    # all-MiniLM-L6-v2 es uncased, pasar a minusculas no cambia el vector
+    return limpiar_html(texto).lower()
+
+embedding_cache = LRUCache(max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL)
+_batch_encoder = None
+
+# Con EMBEDDING_SERVICE_SOCKET los embeddings los calcula el servicio compartido (embedding_service.py)
+def get_batch_encoder() -> BatchEncoder:
+    global _batch_encoder
+    if _batch_encoder is None:
+        if EMBEDDING_SERVICE_SOCKET:
+            from embedding_service import remote_encode_batch
+            _batch_encoder = BatchEncoder(remote_encode_batch)
+        else:
+            _batch_encoder = BatchEncoder()
+    return _batch_encoder
+
+# Embedding de una consulta de busqueda, usando cache y micro-batching
+async def get_query_embedding(texto: str) -> np.ndarray:
+    consulta = normalizar_consulta(texto)
+
+    vector = embedding_cache.get(consulta)
+    if vector is None:
+        vector = await get_batch_encoder().encode(consulta)
+        embedding_cache.set(consulta, vector)
+
+    return vector
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--export":
+        export_onnx(sys.argv[2])
+    else:
+        print("Uso: python embeddings.py --export <carpeta>")
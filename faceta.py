@@ -0,0 +1,144 @@
+import logging
+import os
+import re
+import time
+import unicodedata
+from functools import lru_cache
+from threading import Lock
+import orjson
+from config import FACETA_CHECK_INTERVAL, FACETA_CONFIG_FILE, JERARQUIA_FACETA
+
+logger = logging.getLogger("buscador.faceta")
+
+_ESPACIOS = re.compile(r"\s+")
+
+# Minusculas, sin tildes y con espacios simples: "Comisión de Regulación" == "comision de regulacion".
+# Los valores de Tipo/Entidad se repiten en cada peticion, asi que se normalizan una sola vez
+@lru_cache(maxsize=65536)
+def normalizar_clave(texto: str) -> str:
+    if not texto.isascii():
+        texto = unicodedata.normalize("NFKD", texto)
+        texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _ESPACIOS.sub(" ", texto).strip().lower()
+
+# Clasifica los tipos de documento segun la jerarquia: un solo regex anclado con todas las palabras clave.
+# La alternancia se prueba en orden, asi que gana el primer grupo y la primera clave como en la version anterior
+class ClasificadorFaceta:
+    def __init__(self, jerarquia: dict):
+        self.grupos = list(jerarquia)
+        self._claves = {} # clave normalizada -> (grupo, posicion en la jerarquia)
+        alternativas = []
+
+        for grupo, claves in jerarquia.items():
+            for orden, clave in enumerate(claves):
+                clave = normalizar_clave(clave)
+                if clave not in self._claves:
+                    self._claves[clave] = (grupo, orden)
+                    alternativas.append(re.escape(clave))
+
+        self._regex = re.compile("|".join(alternativas)) if alternativas else None
+        self._memo = {} # Los valores de Tipo se repiten en cada peticion, se clasifican una sola vez
+
+    def clasificar(self, tipo: str) -> tuple:
+        resultado = self._memo.get(tipo)
+        if resultado is None:
+            match = self._regex.match(normalizar_clave(tipo)) if self._regex else None
+            resultado = self._claves[match.group(0)] if match else (None, 0)
+            self._memo[tipo] = resultado
+        return resultado
+
+    # Arma la faceta en una pasada sin modificar la respuesta de elastic (puede venir de un cache)
+    def build(self, aggs: dict) -> dict:
+        if not aggs or "tipo" not in aggs:
+            return {}
+
+        # Un balde por posicion de la jerarquia: concatenarlos da el orden sin hacer sort
+        baldes = {grupo: {} for grupo in self.grupos}
+        otros = []
+
+        for bucket in aggs["tipo"]["buckets"]:
+            grupo, orden = self.clasificar(bucket["key"])
+            tipo_doc = {**bucket}
+            if "entidad" in bucket:
+                tipo_doc["entidad"] = {**bucket["entidad"], "buckets": agrupar_entidades(bucket["entidad"]["buckets"])}
+
+            if grupo is None:
+                otros.append(tipo_doc)
+            else:
+                baldes[grupo].setdefault(orden, []).append(tipo_doc)
+
+        tipo = {
+            "doc_count_error_upper_bound": aggs["tipo"]["doc_count_error_upper_bound"],
+            "sum_other_doc_count": aggs["tipo"]["sum_other_doc_count"],
+        }
+        for grupo in self.grupos:
+            tipo[grupo.lower()] = [b for orden in sorted(baldes[grupo]) for b in baldes[grupo][orden]]
+        tipo["other"] = otros
+
+        return {"tipo": tipo}
+
+# Une las entidades que solo difieren en tildes/mayusculas. "keys" lleva los valores originales de Entidad.keyword
+# para filtrar con terms (SearchFilters.entity acepta la lista) y que el conteo coincida con los resultados
+def agrupar_entidades(buckets: list) -> list:
+    grupos = {}
+    for bucket in buckets:
+        grupos.setdefault(normalizar_clave(bucket["key"]), []).append(bucket)
+
+    entidades = []
+    for grupo in grupos.values():
+        if len(grupo) == 1:
+            entidades.append({**grupo[0], "keys": [grupo[0]["key"]]}) # Caso comun, no hay nada que sumar
+            continue
+
+        por_year = {}
+        for bucket in grupo:
+            for year in bucket.get("year", {}).get("buckets", []):
+                anterior = por_year.get(year["key"])
+                por_year[year["key"]] = year if anterior is None else {**anterior, "doc_count": anterior["doc_count"] + year["doc_count"]}
+
+        entidades.append({
+            **grupo[0],
+            "keys": [bucket["key"] for bucket in grupo],
+            "doc_count": sum(bucket["doc_count"] for bucket in grupo),
+            "year": {"buckets": [por_year[key] for key in sorted(por_year)]}, # Ascendente como el date_histogram
+        })
+
+    return entidades
+
+# Clasificador vigente: JERARQUIA_FACETA o el json de FACETA_CONFIG_FILE, que se recarga al cambiar su mtime
+class _ClasificadorRecargable:
+    def __init__(self, path: str, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self._clasificador = ClasificadorFaceta(JERARQUIA_FACETA)
+        self._mtime = None
+        self._checked = None
+        self._lock = Lock()
+
+    def get(self) -> ClasificadorFaceta:
+        if not self.path:
+            return self._clasificador
+
+        ahora = time.monotonic()
+        if self._checked is not None and ahora - self._checked < self.check_interval:
+            return self._clasificador
+
+        with self._lock:
+            self._checked = ahora
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    with open(self.path, "rb") as f:
+                        self._clasificador = ClasificadorFaceta(orjson.loads(f.read()))
+                    self._mtime = mtime
+                    logger.info("Jerarquia de facetas cargada desde %s", self.path)
+            except (OSError, ValueError, AttributeError, TypeError) as e:
+                # Un archivo a medio escribir o invalido no tumba las busquedas, se sigue con la version anterior
+                logger.warning("No se pudo cargar %s: %s", self.path, e)
+
+        return self._clasificador
+
+_clasificador = _ClasificadorRecargable(FACETA_CONFIG_FILE, FACETA_CHECK_INTERVAL)
+
+def get_clasificador() -> ClasificadorFaceta:
+    return _clasificador.get()
@@ -1,42 +1,140 @@
+import hashlib
 import json
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import lxml.html
 from tqdm import tqdm
-from bs4 import BeautifulSoup
+from texto import extraer_texto, normalizar_texto
 
 campos = {"Epigrafe", "Year", "Numero", "Tipo", "Entidad", "Sigla-Entidad", "Nombre", "NombreEpigrafe"}
 
+METADATA_DIR = "metadatos"
+OUTPUT_FILE = "resultados/datos.jsonl" # Documentos nuevos o modificados, uno por linea
+DELETED_FILE = "resultados/eliminados.jsonl" # doc-name de los documentos que ya no existen
+MANIFEST_FILE = "resultados/manifest.json" # path -> mtime, size y hash del contenido ya indexado
+PENDING_MANIFEST_FILE = "resultados/manifest.pending.json" # Manifest de la ultima extraccion, pasa a MANIFEST_FILE cuando el indexador termina
+EXTRACTION_FILE = "resultados/extraccion.json" # Si datos.jsonl es una extraccion completa o solo el delta
+
+_PARSER = lxml.html.HTMLParser(encoding="cp1252", remove_comments=True)
+
 def htm_to_json(path):
-    with open(path, encoding="cp1252", errors="ignore") as f:
-        soup = BeautifulSoup(f, "lxml")
+    with open(path, "rb") as f:
+        doc = lxml.html.document_fromstring(f.read(), parser=_PARSER)
 
-        data = {}
-        data["title"] = soup.title.text if soup.title else None
-        data["body"] = soup.body.text if soup.body else None
-        data["doc-name"] = path.split("/")[-1]
+    title = doc.findtext(".//title")
+    body = doc.find("body")
 
-        metas = soup.find_all("meta")
-        for meta in metas:
-            if meta.get("name") in campos:
-                data[meta.get("name")] = meta.get("content")
+    data = {}
+    data["title"] = normalizar_texto(title) if title else None
+    data["body"] = extraer_texto(body) if body is not None else None
+    data["doc-name"] = path.split("/")[-1]
 
-        return data
+    for meta in doc.iter("meta"):
+        if meta.get("name") in campos:
+            data[meta.get("name")] = meta.get("content")
 
-results = []
+    return data
 
-if __name__ == "__main__":
-    archivos = os.listdir("metadatos")
-    for file in tqdm(archivos, total=len(archivos)):
-        if file.endswith(".htm"):
-            results.append(htm_to_json(f"metadatos/{file}"))
+def file_hash(path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+# Se ejecuta en los procesos hijos: calcula el hash y solo extrae si el contenido cambio
+def _process_file(args):
+    path, hash_anterior = args
+    hash_actual = file_hash(path)
+    if hash_actual == hash_anterior:
+        return path, hash_actual, None
+
+    return path, hash_actual, htm_to_json(path)
+
+def _load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_json(path: str, datos: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+# Si datos.jsonl trae todo el corpus (extract con full) o solo lo que cambio desde el ultimo indexado
+def extraction_info() -> dict:
+    if not os.path.exists(EXTRACTION_FILE):
+        return {"full": False}
+
+    with open(EXTRACTION_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# La llama el indexador al terminar: desde aqui el delta de la proxima extraccion se calcula contra lo indexado.
+# Si la indexacion falla o no se corre, la siguiente extraccion vuelve a incluir estos cambios
+def commit_extraction():
+    if os.path.exists(PENDING_MANIFEST_FILE):
+        os.replace(PENDING_MANIFEST_FILE, MANIFEST_FILE)
+
+def extract(full: bool = False, workers: int = None):
+    manifest = {} if full else _load_manifest()
+    nuevo_manifest = {}
+    pendientes = []
 
-    print("Generando JSON...")
+    with os.scandir(METADATA_DIR) as entradas:
+        for entrada in entradas:
+            if not entrada.name.endswith(".htm"):
+                continue
+
+            path = f"{METADATA_DIR}/{entrada.name}"
+            stat = entrada.stat()
+            anterior = manifest.get(path)
+
+            # Mismo tamaño y fecha de modificacion: no se abre el archivo
+            if anterior and anterior["mtime"] == stat.st_mtime and anterior["size"] == stat.st_size:
+                nuevo_manifest[path] = anterior
+                continue
+
+            nuevo_manifest[path] = {"mtime": stat.st_mtime, "size": stat.st_size}
+            pendientes.append((path, anterior["hash"] if anterior else None))
+
+    eliminados = [path for path in manifest if path not in nuevo_manifest]
+    extraidos = 0
+
+    print(f"{len(pendientes)} archivos por revisar, {len(eliminados)} eliminados")
+
+    # Los registros se escriben a medida que llegan, la memoria no crece con el corpus
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as salida, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        resultados = pool.map(_process_file, pendientes, chunksize=32)
+
+        for path, hash_actual, data in tqdm(resultados, total=len(pendientes)):
+            nuevo_manifest[path]["hash"] = hash_actual
+            if data is not None:
+                salida.write(json.dumps(data, ensure_ascii=False) + "\n")
+                extraidos += 1
+
+    with open(DELETED_FILE, "w", encoding="utf-8") as f:
+        for path in eliminados:
+            f.write(json.dumps({"doc-name": path.split("/")[-1]}, ensure_ascii=False) + "\n")
+
+    _save_json(PENDING_MANIFEST_FILE, nuevo_manifest)
+    _save_json(EXTRACTION_FILE, {"full": full, "extraidos": extraidos, "eliminados": len(eliminados)})
+
+    return extraidos, len(eliminados)
+
+if __name__ == "__main__":
+    print("Generando JSONL...")
 
     try:
-        with open("resultados/datos.json", "w", encoding="utf-8") as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        extraidos, eliminados = extract(full="--full" in sys.argv)
+        print(f"{extraidos} documentos extraidos, {eliminados} eliminados")
     except FileNotFoundError:
         input("Algo pasoo ingresa otra ruta: ")
     except Exception as e:
         print("Error: ", e)
 
-    print("JSON generado 🐱‍🐉")
\ No newline at end of file
+    print("JSONL generado 🐱‍🐉")
@@ -1,80 +1,395 @@
+import hashlib
 import json
-from pprint import pprint
+import os
+import re
+import sys
+import time
+import uuid
+from collections import deque
+from itertools import islice
+import numpy as np
+from elasticsearch import helpers
 from tqdm import tqdm
-from embeddings import get_embedding
+from embeddings import encode_batch, limpiar_html, split_passages
+from format_data import DELETED_FILE, OUTPUT_FILE, commit_extraction, extraction_info
 from utils import get_es_client
-from config import INDEX_MAPPING, INDEX_NAME, MAX_BULK_SIZE
-
-def sizeof(obj):
-    return len(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
-
-def _create_index(es, overwrite: bool):
-    # Funcion para crear el indice dentro de elastic search
-    print(f"Creando indice {INDEX_NAME}")
-    if es.indices.exists(index=INDEX_NAME):
-        print("El indice ya existe")
-        if overwrite:
-            es.indices.delete(index=INDEX_NAME, ignore_unavailable=True)
-            print("Sobrescribiendo indice...")
-        else:
-            return
-        
-
-    return es.indices.create(
-        index=INDEX_NAME,
-        body = {
-            "mappings": {
-                "properties": INDEX_MAPPING
-            }
+from config import (
+    BULK_CHUNK_SIZE,
+    BULK_MAX_RETRIES,
+    BULK_QUEUE_SIZE,
+    BULK_THREADS,
+    EMBEDDING_BATCH_SIZE,
+    BULK_INDEX_SETTINGS,
+    EMBEDDING_DIMS,
+    EMBEDDING_MODEL,
+    INDEX_KEEP_VERSIONS,
+    INDEX_MAPPING,
+    INDEX_MIN_DOCS_RATIO,
+    INDEX_NAME,
+    INDEX_SETTINGS,
+    MAX_BULK_SIZE,
+    PASSAGE_OVERLAP,
+    PASSAGE_WORDS,
+)
+
+CHECKPOINT_FILE = "resultados/checkpoint.json"
+FAILED_FILE = "resultados/fallidos.jsonl"
+
+_SEPARADOR = re.compile(r"[\s,]*") # Espacios y comas entre los documentos del arreglo
+
+# Indices concretos a los que apunta el alias
+def _alias_indices(es) -> list:
+    if not es.indices.exists_alias(name=INDEX_NAME):
+        return []
+    return list(es.indices.get_alias(name=INDEX_NAME).keys())
+
+# Versiones existentes del indice, de la mas nueva a la mas vieja
+def _index_versions(es) -> list:
+    return sorted(es.indices.get(index=f"{INDEX_NAME}-*", expand_wildcards="open").keys(), reverse=True)
+
+def _create_index(es, overwrite: bool) -> str:
+    # Funcion para crear el indice dentro de elastic search, devuelve el indice donde se debe escribir
+    actuales = _alias_indices(es)
+    legacy = not actuales and es.indices.exists(index=INDEX_NAME) # Indice concreto de antes de usar alias
+
+    if (actuales or legacy) and not overwrite:
+        print("El indice ya existe, se agregan los documentos al indice vigente")
+        return actuales[0] if actuales else INDEX_NAME
+
+    # La api sigue leyendo la version vigente mientras se llena la nueva
+    nombre = f"{INDEX_NAME}-{time.strftime('%Y%m%d%H%M%S')}"
+    print(f"Creando indice {nombre}")
+    es.indices.create(
+        index=nombre,
+        settings=BULK_INDEX_SETTINGS,
+        mappings={
+            "_meta": {"build": True}, # La api rechaza la ingesta mientras haya una version sin publicar
+            "properties": INDEX_MAPPING
         }
     )
+    return nombre
+
+# _meta de una version publicada con una generacion nueva: los caches de la api (IndexGeneration) la usan
+# para descartar lo calculado antes de escribir en el indice vigente
+def generation_meta() -> dict:
+    return {"build": False, "generation": uuid.uuid4().hex}
+
+# Restaura los settings de busqueda y compacta los segmentos antes de exponer el indice
+def _finish_index(es, nombre: str):
+    print(f"Optimizando indice {nombre}...")
+    es.indices.put_settings(index=nombre, settings=INDEX_SETTINGS)
+    es.options(request_timeout=3600).indices.forcemerge(index=nombre, max_num_segments=1)
+    es.indices.refresh(index=nombre)
+    es.cluster.health(index=nombre, wait_for_status="yellow", timeout="5m")
+
+# Cambia el alias a otro indice en una sola operacion atomica
+def _swap_alias(es, nombre: str):
+    acciones = [{"remove": {"index": actual, "alias": INDEX_NAME}} for actual in _alias_indices(es) if actual != nombre]
+
+    if not _alias_indices(es) and es.indices.exists(index=INDEX_NAME):
+        # Migracion: el indice concreto se borra en la misma operacion que crea el alias
+        acciones.append({"remove_index": {"index": INDEX_NAME}})
+
+    acciones.append({"add": {"index": nombre, "alias": INDEX_NAME}})
+    es.indices.put_mapping(index=nombre, meta={"build": False}) # Publicada: deja de bloquear la ingesta
+    es.indices.update_aliases(actions=acciones)
+    print(f"El alias {INDEX_NAME} ahora apunta a {nombre}")
+
+# Borra las versiones viejas que no estan detras del alias
+def _prune_versions(es, keep: int = INDEX_KEEP_VERSIONS):
+    actuales = set(_alias_indices(es))
+    for nombre in _index_versions(es)[keep:]:
+        if nombre not in actuales:
+            es.indices.delete(index=nombre)
+            print(f"Version {nombre} eliminada")
+
+def rollback(es = None):
+    # Vuelve el alias a la version anterior a la vigente
+    es = es or get_es_client()
+    actuales = _alias_indices(es)
+    anteriores = [nombre for nombre in _index_versions(es) if actuales and nombre < min(actuales)]
+
+    if not anteriores:
+        print("No hay una version anterior para hacer rollback")
+        return None
+
+    _swap_alias(es, anteriores[0])
+    return anteriores[0]
+
+# Lee los documentos uno a uno sin cargar todo el archivo en memoria (JSONL o un arreglo JSON)
+def _read_documents(file, chunk_size: int = 1 << 20):
+    with open(file, "r", encoding="utf-8") as f:
+        if file.endswith(".jsonl"):
+            for linea in f:
+                if linea.strip():
+                    yield json.loads(linea)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{file} no contiene un arreglo JSON")
+        pos = 1 # Se avanza por posicion, el buffer solo se recorta al leer otro pedazo
+
+        while True:
+            pos = _SEPARADOR.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+
+            try:
+                documento, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # El documento quedo partido entre dos lecturas, se lee otro pedazo
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+
+            yield documento
+
+def _load_checkpoint(file) -> dict:
+    if not os.path.exists(CHECKPOINT_FILE):
+        return {}
+
+    with open(CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+
+    # Si el archivo se regenero (nueva extraccion) el conteo de procesados ya no aplica
+    mismo = checkpoint.get("file") == os.path.abspath(file) and checkpoint.get("mtime") == os.stat(file).st_mtime_ns
+    return checkpoint if mismo else {}
+
+def _save_checkpoint(file, index: str, procesados: int):
+    tmp = CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"file": os.path.abspath(file), "mtime": os.stat(file).st_mtime_ns, "index": index, "procesados": procesados}, f)
+    os.replace(tmp, CHECKPOINT_FILE) # Escritura atomica, un corte no deja el checkpoint corrupto
+
+# Id estable del documento: reindexar o actualizar el mismo archivo sobrescribe en vez de duplicar
+def document_id(documento: dict) -> str:
+    nombre = documento.get("doc-name")
+    if not nombre:
+        raise ValueError("El documento no tiene doc-name")
+    # Elastic acepta ids de hasta 512 bytes
+    return nombre if len(nombre.encode("utf-8")) <= 512 else hashlib.sha1(nombre.encode("utf-8")).hexdigest()
+
+# Cambia si cambia el documento o la forma de calcular sus embeddings (modelo, dims, fragmentos)
+def document_hash(documento: dict) -> str:
+    contenido = {k: v for k, v in documento.items() if k != "content_hash"}
+    huella = json.dumps([contenido, EMBEDDING_MODEL, EMBEDDING_DIMS, PASSAGE_WORDS, PASSAGE_OVERLAP], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(huella.encode("utf-8")).hexdigest()
+
+# Fragmentos del body que se codifican, el titulo si el documento no tiene texto
+def document_passages(documento: dict) -> list:
+    return split_passages(limpiar_html(documento.get("body") or "")) or [documento.get("title") or ""]
+
+# Documento listo para indexar con el vector de cada fragmento, las busquedas knn usan passages.vector
+def document_source(documento: dict, textos: list, vectores: np.ndarray) -> dict:
+    return {
+        **documento,
+        "content_hash": document_hash(documento),
+        "passages": [{"text": texto, "vector": vector} for texto, vector in zip(textos, vectores)], # float32, el serializador de utils los escribe compactos
+    }
+
+# Descarta los documentos cuyo hash coincide con el que ya esta en el indice, un mget por lote
+def _changed_documents(es, index: str, lote: list, omitidos: list) -> list:
+    ids = [document_id(documento) for documento in lote]
+    existentes = es.mget(index=index, ids=ids, source_includes=["content_hash"])["docs"]
+    hashes = {doc["_id"]: doc.get("_source", {}).get("content_hash") for doc in existentes if doc.get("found")}
+
+    cambiados = [documento for doc_id, documento in zip(ids, lote) if hashes.get(doc_id) != document_hash(documento)]
+    omitidos[0] += len(lote) - len(cambiados)
+    return cambiados
+
+# Genera las acciones del bulk calculando los embeddings por lotes, solo de los documentos nuevos o modificados
+def _generate_actions(es, documentos, index: str, en_vuelo: deque, omitidos: list):
+    while True:
+        lote = list(islice(documentos, EMBEDDING_BATCH_SIZE))
+        if not lote:
+            return
 
-def _insert_documents(file, es, num):
-    print("Insertando documentos...")
+        lote = _changed_documents(es, index, lote, omitidos)
+        if not lote:
+            continue
+
+        # Todos los fragmentos del lote se codifican en un solo llamado al modelo
+        pasajes = [document_passages(documento) for documento in lote]
+        vectores = encode_batch([texto for textos in pasajes for texto in textos])
+
+        inicio = 0
+        for documento, textos in zip(lote, pasajes):
+            vectores_doc = vectores[inicio:inicio + len(textos)]
+            inicio += len(textos)
+
+            accion = {"_index": index, "_id": document_id(documento), "_source": document_source(documento, textos, vectores_doc)}
+            en_vuelo.append(accion)
+            yield accion
+
+def _save_failed(fallidos: list):
+    with open(FAILED_FILE, "a", encoding="utf-8") as f:
+        for accion, error in fallidos:
+            f.write(json.dumps({"error": error, "documento": accion["_source"]}, ensure_ascii=False, default=np.ndarray.tolist) + "\n")
+
+# Reintenta con backoff los documentos rechazados por el cluster con 429 (cola de bulk llena)
+def _retry_rejected(es, rechazados: list) -> list:
+    pendientes = [accion for accion, _ in rechazados]
+    fallidos = []
+    espera = 2
+
+    for _ in range(BULK_MAX_RETRIES):
+        if not pendientes:
+            break
+        time.sleep(espera)
+        espera *= 2
+
+        siguientes = []
+        for i in range(0, len(pendientes), BULK_CHUNK_SIZE):
+            lote = pendientes[i:i + BULK_CHUNK_SIZE]
+            operaciones = []
+            for accion in lote:
+                operaciones.extend(helpers.expand_action(accion))
+
+            respuesta = es.bulk(operations=operaciones)
+            # Los items de la respuesta vienen en el mismo orden que las operaciones
+            for accion, item in zip(lote, respuesta["items"]):
+                _, item = next(iter(item.items()))
+                if item.get("status") == 429:
+                    siguientes.append(accion)
+                elif "error" in item:
+                    fallidos.append((accion, item))
+
+        pendientes = siguientes
+
+    fallidos.extend((accion, {"status": 429, "error": "reintentos agotados"}) for accion in pendientes)
+    return fallidos
+
+def _insert_documents(file, es, num, index: str, inicio: int = 0):
+    print(f"Insertando documentos en {index}...")
+
+    if inicio:
+        print(f"Reanudando desde el documento {inicio}")
+
+    documentos = islice(_read_documents(file), inicio, num)
+    en_vuelo = deque() # parallel_bulk conserva el orden, cada resultado corresponde al primero en vuelo
+    omitidos = [0] # Sin cambios, no pasan por el bulk ni por el checkpoint (al reanudar se vuelven a comparar)
+    rechazados, fallidos = [], []
+    procesados = inicio
+
+    resultados = helpers.parallel_bulk(
+        es,
+        _generate_actions(es, documentos, index, en_vuelo, omitidos),
+        thread_count=BULK_THREADS,
+        queue_size=BULK_QUEUE_SIZE, # Limita los chunks pendientes, el lector no avanza mas rapido que elastic
+        chunk_size=BULK_CHUNK_SIZE,
+        max_chunk_bytes=MAX_BULK_SIZE,
+        raise_on_error=False,
+        raise_on_exception=False,
+    )
 
-    operaciones = []
-    current_bulk_size = 0
-    
     try:
-        data = json.load(open(file, "r", encoding="utf-8"))
-        
-        num = num if num else len(data)
-        
-        for documento in tqdm(data[:num], total=num):
-            op_index = {'index': {'_index':INDEX_NAME}}
-            op_doc = {**documento, 'embedding': get_embedding(documento["body"])}
-
-            op_size = sizeof(op_index) + sizeof(op_doc) # Tamaño del documento aproximado
-
-            # Si se llega al tamaño máximo, se envía la petición :p
-            if current_bulk_size + op_size > MAX_BULK_SIZE and operaciones:
-                es.bulk(operations=operaciones)
-                operaciones = []
-                current_bulk_size = 0
-                
-            # Se agrega al bulk
-            operaciones.append(op_index)
-            operaciones.append(op_doc)
-            current_bulk_size += op_size
-
-        #Enviar sobrante
-        if operaciones:
-            es.bulk(operations=operaciones)
-
-        print("Los documentos fueron insertados")
-    except Exception as e:
-        if operaciones:
-            with open("resultados/procesados.json", "w") as f:
-                json.dump(operaciones, f, ensure_ascii=False, indent=2)
-
-        print(f"Error: {e}\n {len(operaciones)//2} documentos guardados")
-
-
-def index_data(file, num = None, overwrite: bool = False):
-    # Funcion para subir multiples documentos mediante un archivo formato JSON
+        for ok, info in tqdm(resultados, initial=inicio, total=num):
+            accion = en_vuelo.popleft()
+            if not ok:
+                _, item = next(iter(info.items()))
+                if item.get("status") == 429:
+                    rechazados.append((accion, item))
+                else:
+                    fallidos.append((accion, item))
+
+            procesados += 1
+            if procesados % BULK_CHUNK_SIZE == 0:
+                _save_checkpoint(file, index, procesados)
+    except BaseException:
+        # Lo que ya paso por el checkpoint no se vuelve a leer, los fallos se guardan para no perderlos
+        _save_failed(rechazados + fallidos)
+        raise
+    finally:
+        _save_checkpoint(file, index, procesados)
+
+    if rechazados:
+        print(f"Reintentando {len(rechazados)} documentos rechazados por el cluster...")
+        fallidos.extend(_retry_rejected(es, rechazados))
+
+    if fallidos:
+        _save_failed(fallidos)
+        print(f"{len(fallidos)} documentos fallaron, se guardaron en {FAILED_FILE}")
+
+    # Corrida completa, la proxima vez se empieza desde cero
+    os.remove(CHECKPOINT_FILE)
+    print(f"Los documentos fueron insertados, {omitidos[0]} sin cambios se omitieron")
+
+# Borra del indice los documentos que format_data.py ya no encontro
+def _delete_documents(es, index: str, file: str = DELETED_FILE):
+    if not os.path.exists(file):
+        return
+
+    acciones = ({"_op_type": "delete", "_index": index, "_id": document_id(documento)} for documento in _read_documents(file))
+    borrados, errores = helpers.bulk(es, acciones, chunk_size=BULK_CHUNK_SIZE, raise_on_error=False)
+    # Borrar un documento que no esta (p.ej. nunca se indexo) no es un error
+    errores = [error["delete"] for error in errores if error.get("delete", {}).get("status") != 404]
+
+    print(f"{borrados} documentos eliminados del indice")
+    if errores:
+        print(f"{len(errores)} borrados fallaron, primer error: {errores[0].get('error')}")
+
+
+# La version nueva debe tener al menos INDEX_MIN_DOCS_RATIO de los documentos de la vigente
+def _check_doc_count(es, nombre: str) -> bool:
+    actuales = _alias_indices(es) or ([INDEX_NAME] if es.indices.exists(index=INDEX_NAME) else [])
+    if not actuales:
+        return True
+
+    vigente = es.count(index=",".join(actuales))["count"]
+    nuevo = es.count(index=nombre)["count"]
+    if nuevo >= vigente * INDEX_MIN_DOCS_RATIO:
+        return True
+
+    print(f"{nombre} tiene {nuevo} documentos y la version vigente {vigente}, no se cambia el alias (usar --force si es correcto)")
+    return False
+
+def _same_file(a, b) -> bool:
+    return os.path.abspath(a) == os.path.abspath(b)
+
+def index_data(file, num = None, overwrite: bool = False, force: bool = False):
+    # Funcion para subir multiples documentos mediante un archivo formato JSON o JSONL
+    if overwrite and _same_file(file, OUTPUT_FILE) and not extraction_info().get("full"):
+        # Un indice nuevo construido con solo el delta dejaria fuera todo lo que no cambio
+        raise SystemExit(f"{file} solo tiene los documentos modificados, --overwrite requiere extraer con format_data.py --full")
+
     es = get_es_client()
-    _create_index(es=es, overwrite=overwrite)
-    _insert_documents(es=es, num=num, file=file)
+    checkpoint = _load_checkpoint(file)
+
+    if checkpoint and es.indices.exists(index=checkpoint["index"]):
+        # Se esta reanudando una corrida, se sigue escribiendo en el mismo indice
+        index, inicio = checkpoint["index"], checkpoint["procesados"]
+    else:
+        index, inicio = _create_index(es=es, overwrite=overwrite), 0
+
+    _insert_documents(es=es, num=num, file=file, index=index, inicio=inicio)
+
+    vigente = index == INDEX_NAME or index in _alias_indices(es)
+    if vigente:
+        # Corrida incremental sobre el indice vigente: tambien se quitan los documentos eliminados
+        _delete_documents(es, index)
+        es.indices.put_mapping(index=index, meta=generation_meta())
+    else:
+        # Indice nuevo: se optimiza y se expone cambiando el alias, sin ventana de busqueda degradada
+        _finish_index(es, index)
+        if not force and not _check_doc_count(es, index):
+            return
+        _swap_alias(es, index)
+        _prune_versions(es)
+
+    # Todo quedo indexado: la proxima extraccion se compara contra estos archivos
+    if num is None and _same_file(file, OUTPUT_FILE):
+        commit_extraction()
 
 if __name__ == "__main__":
-     index_data("./resultados/datos.json", overwrite=True)
\ No newline at end of file
+    if "--rollback" in sys.argv:
+        rollback()
+    else:
+        # Sin --overwrite la corrida es incremental: upsert de lo que cambio y borrado de lo eliminado.
+        # format_data.py solo escribe lo nuevo o modificado, sobrescribir requiere una extraccion con --full.
+        # Mientras la version nueva no esta detras del alias la api rechaza la ingesta (409), lo que escribiera
+        # en la vigente se perderia al cambiar el alias
+        index_data(OUTPUT_FILE, overwrite="--overwrite" in sys.argv, force="--force" in sys.argv)
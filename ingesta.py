@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+import numpy as np
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk
+from config import (
+    BULK_CHUNK_SIZE,
+    EMBEDDING_MAX_BATCH,
+    EMBEDDING_SERVICE_SOCKET,
+    INDEX_NAME,
+    INGEST_BATCH_SIZE,
+    INGEST_JOBS_KEPT,
+    INGEST_QUEUE_SIZE,
+    MAX_BULK_SIZE,
+)
+from embeddings import encode_batch
+from indexar_data import document_passages, document_source, generation_meta
+
+logger = logging.getLogger("buscador.ingesta")
+
+class IngestQueueFullError(RuntimeError):
+    pass
+
+class IngestBlockedError(RuntimeError):
+    pass
+
+# Versiones que indexar_data.py --overwrite esta construyendo desde el archivo (_meta.build, se quita al publicarlas).
+# Lo que se escriba en la vigente se pierde cuando esa version pasa al alias. Una version que quedo libre por un
+# rollback no lleva la marca y no bloquea la ingesta
+async def unpublished_builds(es: AsyncElasticsearch) -> list:
+    mappings = await es.indices.get_mapping(index=f"{INDEX_NAME}-*", expand_wildcards="open", filter_path="*.mappings._meta")
+    return sorted(nombre for nombre, datos in mappings.items() if datos["mappings"]["_meta"].get("build"))
+
+async def check_no_build(es: AsyncElasticsearch) -> None:
+    construyendo = await unpublished_builds(es)
+    if construyendo:
+        raise IngestBlockedError(
+            f"Se esta construyendo {construyendo[-1]} con indexar_data.py --overwrite, reintentar cuando cambie el alias "
+            "(si la construccion se abandono hay que borrar ese indice)"
+        )
+
+# Embeddings de los fragmentos sin pasar por el micro-batching de las consultas, que tiene su propia cola acotada
+async def _encode(textos: list) -> np.ndarray:
+    if not EMBEDDING_SERVICE_SOCKET:
+        return await asyncio.to_thread(encode_batch, textos)
+
+    from embedding_service import remote_encode_batch
+
+    # Pedazos del tamaño de un batch de consultas para no pasar el timeout del servicio
+    partes = [await remote_encode_batch(textos[i:i + EMBEDDING_MAX_BATCH]) for i in range(0, len(textos), EMBEDDING_MAX_BATCH)]
+    return np.concatenate(partes)
+
+# Cola de trabajos de indexacion (upsert/delete) que procesa un worker en segundo plano.
+# Los trabajos viven en la memoria del proceso: con varios workers de uvicorn el estado se consulta en el que lo recibio.
+# Mientras hay una reconstruccion sin publicar los trabajos se rechazan (status "rejected") en vez de escribir en un
+# indice que esta por dejar de ser el vigente
+class IngestQueue:
+    def __init__(
+        self,
+        max_jobs: int = INGEST_QUEUE_SIZE,
+        batch_size: int = INGEST_BATCH_SIZE,
+        jobs_kept: int = INGEST_JOBS_KEPT,
+        on_done: Optional[Callable[[dict], None]] = None,
+    ):
+        self.batch_size = batch_size
+        self.jobs_kept = jobs_kept
+        self.on_done = on_done # p.ej. invalidar los caches cuando cambian documentos
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_jobs)
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self, es: AsyncElasticsearch) -> None:
+        self._worker = asyncio.create_task(self._run(es))
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    # operaciones: lista de ("index", id, documento) o ("delete", id, None)
+    def submit(self, operaciones: list) -> dict:
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "total": len(operaciones),
+            "indexed": 0,
+            "deleted": 0,
+            "failed": 0,
+            "errors": [],
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+
+        try:
+            self._queue.put_nowait((job, operaciones))
+        except asyncio.QueueFull:
+            raise IngestQueueFullError("Hay demasiados trabajos de indexacion en cola")
+
+        self._jobs[job["id"]] = job
+        while len(self._jobs) > self.jobs_kept:
+            self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    async def _run(self, es: AsyncElasticsearch) -> None:
+        while True:
+            job, operaciones = await self._queue.get()
+            job["status"] = "running"
+            try:
+                for i in range(0, len(operaciones), self.batch_size):
+                    await check_no_build(es) # Por lote: la reconstruccion pudo empezar despues de encolar el trabajo
+                    await self._process_batch(es, job, operaciones[i:i + self.batch_size])
+                job["status"] = "done" if not job["failed"] else "partial"
+            except IngestBlockedError as e:
+                logger.warning("Trabajo de indexacion %s rechazado: %s", job["id"], e)
+                job["status"] = "rejected"
+                job["errors"].append({"error": str(e)})
+            except Exception as e:
+                logger.exception("Fallo el trabajo de indexacion %s", job["id"])
+                job["status"] = "failed"
+                job["errors"].append({"error": str(e)})
+            finally:
+                job["finished_at"] = time.time()
+                self._queue.task_done()
+
+            if job["indexed"] or job["deleted"]:
+                try:
+                    # Generacion nueva en el indice: los caches de todos los workers dejan de usar lo anterior
+                    await es.indices.put_mapping(index=INDEX_NAME, meta=generation_meta())
+                except Exception:
+                    logger.exception("No se pudo actualizar la generacion del indice tras el trabajo %s", job["id"])
+                if self.on_done is not None:
+                    self.on_done(job)
+
+    async def _process_batch(self, es: AsyncElasticsearch, job: dict, lote: list) -> None:
+        documentos = [(doc_id, documento) for accion, doc_id, documento in lote if accion == "index"]
+
+        # Todos los fragmentos del lote se codifican juntos, igual que en indexar_data
+        pasajes = [document_passages(documento) for _, documento in documentos]
+        textos = [texto for textos_doc in pasajes for texto in textos_doc]
+        vectores = await _encode(textos) if textos else None
+
+        acciones = []
+        inicio = 0
+        for (doc_id, documento), textos_doc in zip(documentos, pasajes):
+            vectores_doc = vectores[inicio:inicio + len(textos_doc)]
+            inicio += len(textos_doc)
+            acciones.append({"_index": INDEX_NAME, "_id": doc_id, "_source": document_source(documento, textos_doc, vectores_doc)})
+
+        acciones.extend({"_op_type": "delete", "_index": INDEX_NAME, "_id": doc_id} for accion, doc_id, _ in lote if accion == "delete")
+
+        _, errores = await async_bulk(
+            es,
+            acciones,
+            chunk_size=BULK_CHUNK_SIZE,
+            max_chunk_bytes=MAX_BULK_SIZE,
+            max_retries=3, # Reintenta con backoff los rechazos 429
+            raise_on_error=False,
+            refresh="wait_for", # Al terminar el trabajo los cambios ya son visibles en las busquedas
+        )
+
+        fallidos = {}
+        for error in errores:
+            operacion, item = next(iter(error.items()))
+            if operacion == "delete" and item.get("status") == 404:
+                continue # Borrar algo que no existe no es un error
+            fallidos[item.get("_id")] = (operacion, item)
+
+        for accion, doc_id, _ in lote:
+            if doc_id in fallidos:
+                job["failed"] += 1
+                if len(job["errors"]) < 20:
+                    job["errors"].append({"id": doc_id, "error": fallidos[doc_id][1].get("error")})
+            elif accion == "index":
+                job["indexed"] += 1
+            else:
+                job["deleted"] += 1
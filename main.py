@@ -1,12 +1,130 @@
-from config import HIGHLIGHTER_CONFIG, INDEX_NAME, MIN_SCORE_THRESHOLD, regular_search_query, semantic_search_query
-from fastapi import Body, FastAPI, HTTPException, Query
+import asyncio
+import hashlib
+import secrets
+import time
+import orjson
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+from cache import IndexGeneration, LRUCache, ResultCache
+from config import (
+    AGGS_CACHE_SIZE,
+    AGGS_CACHE_TTL,
+    ES_PROFILE_ENABLED,
+    EMBEDDING_SERVICE_SOCKET,
+    EMBEDDING_WARMUP,
+    FACETA_AGGS,
+    GENERATION_CHECK_INTERVAL,
+    HIGHLIGHTER_CONFIG,
+    GZIP_MIN_SIZE,
+    INDEX_NAME,
+    INGEST_MAX_DOCS,
+    INGEST_TOKEN,
+    LIST_SOURCE_INCLUDES,
+    MIN_SCORE_THRESHOLD,
+    PIT_KEEP_ALIVE,
+    QUERY_ROUTING,
+    RESULT_CACHE_REDIS_URL,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    SELECTS_AGGS,
+    SELECTS_MAX_AGE,
+    SEMANTIC_HIGHLIGHTER_CONFIG,
+    SOURCE_EXCLUDES,
+    SUGGEST_CACHE_SIZE,
+    SUGGEST_CACHE_TTL,
+    SUGGEST_MIN_CHARS,
+    SUGGEST_SIZE,
+    SUGGEST_TIMEOUT,
+    VALORES_AGGS,
+    highlighter_config,
+    knn_search_query,
+    precompile,
+    regular_search_query,
+    semantic_search_query,
+    suggest_query,
+)
+from consulta import EXACT_SORT, ValoresConocidos, exact_search_query
+from elasticsearch import AsyncElasticsearch, NotFoundError
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from indexar_data import document_id
+from ingesta import IngestBlockedError, IngestQueue, IngestQueueFullError, check_no_build
 from elastic_transport import ObjectApiResponse
-from embeddings import get_embedding
-from models import SearchBody
-from utils import build_faceta, build_query, get_es_client
+from embeddings import EncoderBusyError, embedding_cache, get_query_embedding, warmup
+from metricas import etapa, finalizar_peticion, iniciar_peticion, medir, medir_es, registrar_cache, registrar_query, registrar_ruta
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+# Brotli es opcional (pip install brotli-asgi), sin el paquete se comprime con gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+from models import HybridSearchBody, SearchBody
+from utils import (
+    build_faceta,
+    build_query,
+    decode_cursor,
+    encode_cursor,
+    filters_key,
+    get_async_es_client,
+    knn_filter,
+    normalize_search_query,
+    reciprocal_rank_fusion,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un solo cliente (y su pool de conexiones) para toda la vida de la app
+    app.state.es = get_async_es_client()
+    if EMBEDDING_WARMUP and not EMBEDDING_SERVICE_SOCKET: # Con el servicio externo la api no carga el modelo
+        await asyncio.to_thread(warmup)
+    if INGEST_TOKEN:
+        ingest_queue.start(app.state.es)
+    try:
+        yield
+    finally:
+        await ingest_queue.stop()
+        await app.state.es.close()
+        await result_cache.close()
+
+def get_es(request: Request) -> AsyncElasticsearch:
+    return request.app.state.es
+
+# Partes constantes de los cuerpos de busqueda, serializadas una sola vez
+SOURCE_FRAGMENT = precompile({"excludes": SOURCE_EXCLUDES})
+LIST_SOURCE_FRAGMENT = precompile({"includes": LIST_SOURCE_INCLUDES})
+HIGHLIGHT_FRAGMENT = precompile(HIGHLIGHTER_CONFIG)
+SEMANTIC_HIGHLIGHT_FRAGMENT = precompile(SEMANTIC_HIGHLIGHTER_CONFIG)
+SELECTS_AGGS_FRAGMENT = precompile(SELECTS_AGGS)
+FACETA_AGGS_FRAGMENT = precompile(FACETA_AGGS)
+VALORES_AGGS_FRAGMENT = precompile(VALORES_AGGS)
+
+# La vista "list" no trae el body: menos bytes desde elastic, menos json que serializar y enviar
+def source_fragment(body: SearchBody):
+    return LIST_SOURCE_FRAGMENT if body.view == "list" else SOURCE_FRAGMENT
+
+# Con lazy_highlight la lista solo resalta el epigrafe, el body se resalta al abrir cada documento
+def highlight_fragment(body: SearchBody):
+    return SEMANTIC_HIGHLIGHT_FRAGMENT if body.lazy_highlight else HIGHLIGHT_FRAGMENT
+
+# Cache de agregaciones, cualquier objeto con get/set (p.ej. un cliente externo) puede reemplazarlo
+aggs_cache = LRUCache(max_size=AGGS_CACHE_SIZE, ttl=AGGS_CACHE_TTL)
+suggest_cache = LRUCache(max_size=SUGGEST_CACHE_SIZE, ttl=SUGGEST_CACHE_TTL)
+result_cache = ResultCache(max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, redis_url=RESULT_CACHE_REDIS_URL)
+# Indice detras del alias, al cambiar (reindexacion) las entradas viejas dejan de usarse
+index_generation = IndexGeneration(INDEX_NAME, check_interval=GENERATION_CHECK_INTERVAL)
 
-app = FastAPI()
+# La cola cambia la generacion del indice al escribir, este worker la relee sin esperar GENERATION_CHECK_INTERVAL
+ingest_queue = IngestQueue(on_done=lambda job: index_generation.invalidate())
+
+registrar_cache("embedding", embedding_cache)
+registrar_cache("aggs", aggs_cache)
+registrar_cache("suggest", suggest_cache)
+registrar_cache("results", result_cache)
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -14,52 +132,205 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=GZIP_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+
+# Duracion total y por etapa de cada peticion: histogramas en /metrics y header Server-Timing
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    datos = iniciar_peticion()
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route else "unmatched" # La plantilla de la ruta, no la url, para no disparar la cardinalidad
+        server_timing = finalizar_peticion(datos, endpoint, status, time.perf_counter() - inicio)
+
+    response.headers["Server-Timing"] = server_timing
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Busqueda de regular_search. Con aggs, las agregaciones van en el mismo request del texto completo
+# (la ruta exacta no las lleva, sus filtros no describen el texto de la consulta)
+async def run_regular_search(es: AsyncElasticsearch, search_query: str, body: SearchBody, aggs=None) -> dict:
+    # Identificadores exactos: primero el query de solo filtros, el texto completo solo si no encuentra nada
+    if QUERY_ROUTING and not (body.use_cursor or body.cursor):
+        exact_query = exact_search_query(search_query, await get_valores_conocidos(es))
+        if exact_query is not None:
+            if body.filters:
+                build_query(query=exact_query, filters=body.filters)
+
+            result = await paginated_search(es, body, {
+                "query": exact_query,
+                "sort": EXACT_SORT, # Los filtros no dan puntaje, sin sort el orden seria el del indice
+                "_source": source_fragment(body)
+            })
+            # Con track_total_hits en 0/false el total no viene, los hits de la pagina tambien cuentan
+            if result["hits"] or result["total_hits"] > 0:
+                registrar_ruta("exact")
+                return result
+            registrar_ruta("exact_fallback")
+        else:
+            registrar_ruta("full_text")
+
+    query = regular_search_query(search_query)
+
+    if body.filters:
+        with etapa("build_query"):
+            build_query(query=query, filters=body.filters)
+
+    search_body = {
+        "query": query,
+        "_source": source_fragment(body),
+        "highlight": highlight_fragment(body)
+    }
+    if aggs is not None:
+        search_body["aggs"] = aggs
+
+    return await paginated_search(es, body, search_body)
+
+# Cache de regular_search, tambien lo usa search_with_facets para devolver exactamente los mismos resultados
+async def cached_regular_search(es: AsyncElasticsearch, search_query: str, body: SearchBody, search: Callable[[], Awaitable[dict]]) -> dict:
+    # El cursor (point-in-time) y el profile son de una sola peticion, no se cachean
+    if body.use_cursor or body.cursor or body.profile:
+        return await search()
+
+    generation = await index_generation.get(es)
+    key = result_cache.key("regular_search", generation, normalize_search_query(search_query), body.model_dump_json(exclude_none=True))
+    return await result_cache.get_or_compute(key, search)
 
 @app.post("/api/v1/regular_search/")
 async def regular_search(
     search_query: str = Query(..., min_length=1),
-    body: SearchBody = Body(...)
+    body: SearchBody = Body(...),
+    es: AsyncElasticsearch = Depends(get_es)
 ):
     try:
-        es = get_es_client(max_retries=1, sleep_time=0)
-        query = regular_search_query(search_query)
-
-        if body.filters:
-            build_query(query=query, filters=body.filters)
+        return await cached_regular_search(es, search_query, body, lambda: run_regular_search(es, search_query, body))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        skip, limit = body.skip * body.limit, body.limit
+SEARCH_FILTER_PATH = [
+    "took",
+    "hits.hits._id",
+    "hits.hits._source",
+    "hits.hits._score",
+    "hits.hits.highlight",
+    "hits.hits.inner_hits.passages.hits.hits._source",
+    "hits.total",
+    "aggregations",
+]
 
-        response = es.search(
+# Tipos y entidades del indice vigente para el analisis de consultas, se recalculan al cambiar la generacion
+async def get_valores_conocidos(es: AsyncElasticsearch) -> ValoresConocidos:
+    generation = await index_generation.get(es)
+    key = ("valores", generation)
+    valores = aggs_cache.get(key)
+    if valores is None:
+        response = await medir_es(es.search(
             index=INDEX_NAME,
-            body={
-                "query": query,
-                "from": skip,
-                "size": limit,
-                "_source": {
-                    "excludes": ["embedding"]
-                },
-                "highlight": HIGHLIGHTER_CONFIG
-            },
-            filter_path=[
-                "hits.hits._source",
-                "hits.hits._score",
-                "hits.hits.highlight",
-                "hits.total",
-            ]
-        )
+            body={"size": 0, "aggs": VALORES_AGGS_FRAGMENT},
+            filter_path=["took", "aggregations"]
+        ))
+        valores = ValoresConocidos.from_aggs(response.get("aggregations", {}))
+        aggs_cache.set(key, valores)
+    return valores
+
+# Ejecuta la busqueda paginando con from/size o, en modo cursor, con point-in-time + search_after
+async def paginated_search(es: AsyncElasticsearch, body: SearchBody, search_body: dict) -> dict:
+    search_body = {**search_body, "size": body.limit}
+    if body.track_total_hits is not None:
+        search_body["track_total_hits"] = body.track_total_hits
 
+    filter_path = SEARCH_FILTER_PATH
+    if body.profile:
+        if not ES_PROFILE_ENABLED:
+            raise HTTPException(status_code=403, detail="El profile de elastic no esta habilitado (ES_PROFILE_ENABLED)")
+        search_body["profile"] = True
+        filter_path = filter_path + ["profile"]
+
+    if not (body.use_cursor or body.cursor):
+        search_body["from"] = body.skip * body.limit
+        registrar_query(search_body)
+        response = await medir_es(es.search(index=INDEX_NAME, body=search_body, filter_path=filter_path))
+        hits = attach_snippets(response["hits"].get("hits", []))
         total_hits = get_total_hits(response)
-        max_pages = calculate_max_pages(total_hits, body.limit)
 
         return {
-            "hits": response["hits"].get("hits", []),
-            "max_pages": total_hits,
+            "hits": hits,
+            "total_hits": total_hits,
+            "max_pages": calculate_max_pages(total_hits, body.limit),
+            **get_aggregations(response),
+            **get_profile(response),
         }
-    except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
-    
+
+    if body.cursor:
+        try:
+            cursor = decode_cursor(body.cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        pit_id = cursor["pit_id"]
+        search_body["search_after"] = cursor["search_after"]
+    else:
+        pit_id = (await medir_es(es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE)))["id"]
+
+    # El costo por pagina es constante: no hay from, se continua desde el sort del ultimo hit
+    search_body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+    search_body["sort"] = [{"_score": "desc"}, {"_shard_doc": "asc"}]
+
+    registrar_query(search_body)
+    response = await medir_es(es.search(body=search_body, filter_path=filter_path + ["hits.hits.sort", "pit_id"]))
+    hits = attach_snippets(response["hits"].get("hits", []))
+    total_hits = get_total_hits(response)
+    pit_id = response.get("pit_id", pit_id)
+
+    next_cursor = None
+    if len(hits) == body.limit:
+        next_cursor = encode_cursor(pit_id, hits[-1]["sort"])
+    else:
+        await medir_es(es.close_point_in_time(id=pit_id)) # Ultima pagina, se libera el contexto en el cluster
+
+    for hit in hits:
+        hit.pop("sort", None)
+
+    return {
+        "hits": hits,
+        "total_hits": total_hits,
+        "max_pages": calculate_max_pages(total_hits, body.limit),
+        "next_cursor": next_cursor,
+        **get_aggregations(response),
+        **get_profile(response),
+    }
+
+# Mueve el fragmento que encontro el knn (inner_hits) a hit["snippet"]
+def attach_snippets(hits: list) -> list:
+    for hit in hits:
+        passages = hit.pop("inner_hits", {}).get("passages", {}).get("hits", {}).get("hits", [])
+        if passages:
+            hit["snippet"] = passages[0].get("_source", {}).get("text")
+    return hits
+
+# Solo se agrega la llave si la busqueda pidio agregaciones
+def get_aggregations(response: ObjectApiResponse) -> dict:
+    aggregations = response.get("aggregations")
+    return {"aggregations": aggregations} if aggregations is not None else {}
+
+def get_profile(response: ObjectApiResponse) -> dict:
+    profile = response.get("profile")
+    return {"profile": profile} if profile is not None else {}
+
 def get_total_hits(response: ObjectApiResponse) -> int:
-    return response["hits"]["total"]["value"]
+    return response["hits"].get("total", {}).get("value", 0)
 
 
 def calculate_max_pages(total_hits: int, limit: int) -> int:
@@ -67,144 +338,421 @@ def calculate_max_pages(total_hits: int, limit: int) -> int:
 
 
 @app.post("/api/v1/semantic_search")
-def semantic_search(
+async def semantic_search(
     search_query: str = Query(..., min_length=1),
-    body: SearchBody = Body(...)
+    body: SearchBody = Body(...),
+    es: AsyncElasticsearch = Depends(get_es)
 ):
     try:
-        es = get_es_client(max_retries=1, sleep_time=0)
-        embedded_query = get_embedding(search_query)
+        embedded_query = await medir("embedding", get_query_embedding(search_query))
 
         query = semantic_search_query(search_query, embedded_query)
 
         if body.filters:
-            build_query(query=query, filters=body.filters)
+            with etapa("build_query"):
+                build_query(query=query, filters=body.filters)
+
+        return await paginated_search(es, body, {
+            "query": query,
+            "min_score": MIN_SCORE_THRESHOLD,
+            "_source": source_fragment(body),
+            "highlight": SEMANTIC_HIGHLIGHT_FRAGMENT
+        })
+    except HTTPException:
+        raise
+    except (EncoderBusyError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=503, detail=str(e) or "Tiempo de espera agotado calculando el embedding")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+@app.post("/api/v1/hybrid_search")
+async def hybrid_search(
+    search_query: str = Query(..., min_length=1),
+    body: HybridSearchBody = Body(...),
+    es: AsyncElasticsearch = Depends(get_es)
+):
+    try:
+        options = body.hybrid
+        embedded_query = await medir("embedding", get_query_embedding(search_query))
+
+        query = regular_search_query(search_query)
+
+        if body.filters:
+            with etapa("build_query"):
+                build_query(query=query, filters=body.filters)
+
+        filter_query = knn_filter(query)
+
+        if options.fusion == "linear":
+            # Elastic suma el puntaje del knn y el del BM25, una sola peticion
+            query["bool"]["boost"] = options.bm25_boost
+            return await paginated_search(es, body, {
+                "query": query,
+                "knn": knn_search_query(embedded_query, options.k, options.num_candidates, filter_query, options.knn_boost),
+                "_source": source_fragment(body),
+                "highlight": highlight_fragment(body)
+            })
+
+        if body.use_cursor or body.cursor:
+            raise HTTPException(status_code=400, detail="La fusion rrf solo soporta paginacion con skip/limit")
+
+        return await rrf_search(es, body, query, embedded_query, filter_query)
+    except HTTPException:
+        raise
+    except (EncoderBusyError, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=503, detail=str(e) or "Tiempo de espera agotado calculando el embedding")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        skip, limit = body.skip * body.limit, body.limit
+# Ejecuta las piernas BM25 y knn en un msearch, las fusiona con RRF y trae solo la pagina pedida
+async def rrf_search(es: AsyncElasticsearch, body: HybridSearchBody, query: dict, embedded_query, filter_query) -> dict:
+    options = body.hybrid
+    skip, limit = body.skip * body.limit, body.limit
+    window = max(options.k, skip + limit)
 
-        response = es.search(
+    registrar_query({"query": query})
+    legs = await medir_es(es.msearch(
+        searches=[
+            {"index": INDEX_NAME},
+            {"query": query, "size": window, "_source": False},
+            {"index": INDEX_NAME},
+            {"knn": knn_search_query(embedded_query, window, options.num_candidates, filter_query), "size": window, "_source": False},
+        ],
+        filter_path=["took", "responses.hits.hits._id", "responses.error"]
+    ))
+
+    rankings = []
+    for leg in legs["responses"]:
+        if "error" in leg:
+            raise HTTPException(status_code=500, detail=str(leg["error"]))
+        rankings.append([hit["_id"] for hit in leg.get("hits", {}).get("hits", [])])
+
+    fused = reciprocal_rank_fusion(rankings, options.rank_constant)
+    page = fused[skip:skip + limit]
+    hits = []
+
+    if page:
+        # Se traen los documentos de la pagina, el query lexico solo se usa para resaltar
+        response = await medir_es(es.search(
             index=INDEX_NAME,
             body={
-                "query": query,
-                "from": skip,
+                "query": {"ids": {"values": [doc_id for doc_id, _ in page]}},
                 "size": limit,
-                "min_score": MIN_SCORE_THRESHOLD,
-                "_source": {
-                    "excludes": ["embedding"]
-                },
-                "highlight": HIGHLIGHTER_CONFIG
+                "_source": source_fragment(body),
+                "highlight": {**(SEMANTIC_HIGHLIGHTER_CONFIG if body.lazy_highlight else HIGHLIGHTER_CONFIG), "highlight_query": query}
             },
-            filter_path=[
-                "hits.hits._source",
-                "hits.hits._score",
-                "hits.hits.highlight",
-                "hits.total",
-            ]
-        )
+            filter_path=["took", "hits.hits._id", "hits.hits._source", "hits.hits.highlight"]
+        ))
+        by_id = {hit["_id"]: hit for hit in response["hits"].get("hits", [])}
 
-        total_hits = get_total_hits(response)
-        max_pages = calculate_max_pages(total_hits, body.limit)
+        for doc_id, score in page:
+            if doc_id in by_id:
+                hit = by_id[doc_id]
+                hit["_score"] = score
+                hits.append(hit)
+
+    return {
+        "hits": hits,
+        "total_hits": len(fused), # Union de ambas listas, acotada por la ventana de candidatos
+        "max_pages": calculate_max_pages(len(fused), body.limit),
+    }
 
-        return {
-            "hits": response["hits"].get("hits", []),
-            "max_pages": total_hits,
-        }
-    except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
-    
 @app.get("/api/v1/search/filters")
-def get_selects():
+async def get_selects(
+    request: Request,
+    response: Response,
+    es: AsyncElasticsearch = Depends(get_es)
+):
     try:
-        es = get_es_client(max_retries=1, sleep_time=0)
-        
-        aggs = {
-            "tipos": {
-                "terms": {
-                    "field": "Tipo.keyword",
-                    "order": {"_key": "asc"},
-                    "min_doc_count": 1
+        generation = await index_generation.get(es)
+        key = ("selects", generation)
+        cached = aggs_cache.get(key)
+        if cached is None:
+            es_response = await medir_es(es.search(
+                index=INDEX_NAME,
+                body={
+                    "size": 0,
+                    "aggs": SELECTS_AGGS_FRAGMENT
                 },
-            },
-            "entidades": {
-                "terms": {
-                    "field": "Entidad.keyword",
-                    "order": {"_key": "asc"},
-                    "min_doc_count": 1
-                }
-            }
-        }
-        
-        response = es.search(
-            index=INDEX_NAME,
-            body={
-                "size": 0,
-                "aggs": aggs
+                filter_path=["took", "aggregations"]
+            ))
+            result = {
+                "filters": es_response.get("aggregations", {})
             }
-        )
+            # El ETag sale del contenido: cualquier documento escrito que cambie un conteo cambia el ETag
+            etag = f'"{hashlib.sha1(orjson.dumps(result, option=orjson.OPT_SORT_KEYS)).hexdigest()}"'
+            cached = (result, etag)
+            aggs_cache.set(key, cached)
 
-        return {
-            "filters": response.get("aggregations", {})
-        }
+        result, etag = cached
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={SELECTS_MAX_AGE}"}
+
+        # Si los valores no cambiaron el navegador reutiliza su copia
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+        return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.post("/api/v1/filter_fragments")
-def filter_fragments(
+async def filter_fragments(
     search_query: str = Query(..., min_length=1),
-    body: SearchBody = Body(...)
+    body: SearchBody = Body(...),
+    es: AsyncElasticsearch = Depends(get_es)
 ):
     try:
-        es = get_es_client(max_retries=1, sleep_time=0)
+        return await get_facets(es, search_query, body)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        query = regular_search_query(search_query)
+async def facets_key(es: AsyncElasticsearch, search_query: str, body: SearchBody) -> tuple:
+    generation = await index_generation.get(es)
+    return ("filter_fragments", generation, normalize_search_query(search_query), filters_key(body.filters))
 
-        if body.filters:
+def set_facets(key: tuple, aggregations: dict) -> dict:
+    with etapa("faceta"):
+        facets = {
+            "filters": build_faceta(aggregations)
+        }
+    aggs_cache.set(key, facets)
+    return facets
+
+# Faceta del texto completo de la consulta con sus filtros, la comparten filter_fragments y search_with_facets
+async def get_facets(es: AsyncElasticsearch, search_query: str, body: SearchBody) -> dict:
+    key = await facets_key(es, search_query, body)
+    facets = aggs_cache.get(key)
+    if facets is not None:
+        return facets
+
+    query = regular_search_query(search_query)
+
+    if body.filters:
+        with etapa("build_query"):
             build_query(query=query, filters=body.filters)
 
-        aggs = {
-            "tipo": {
-                "terms": {
-                    "field": "Tipo.keyword",
-                    "order": {"_key": "asc"},
-                    "min_doc_count": 1
-                },
-                "aggs": {
-                    "entidad": {
-                        "terms": {
-                            "field": "Entidad.keyword",
-                            "order": {"_key": "asc"},
-                            "min_doc_count": 1
-                        },
-                        "aggs": {
-                            "year": {
-                                "date_histogram": {
-                                    "field": "Year",
-                                    "calendar_interval": "year",
-                                    "format": "yyyy",
-                                    "min_doc_count": 1
-                                }
-                            }
-                        }
-                    }
-                }
-            }
-        }
+    registrar_query({"query": query})
+    es_response = await medir_es(es.search(
+        index=INDEX_NAME,
+        body={
+            "size": 0,
+            "query": query,
+            "aggs": FACETA_AGGS_FRAGMENT
+        },
+        filter_path=["took", "aggregations"]
+    ))
+    return set_facets(key, es_response.get("aggregations", {}))
+
+@app.post("/api/v1/search_with_facets")
+async def search_with_facets(
+    search_query: str = Query(..., min_length=1),
+    body: SearchBody = Body(...),
+    es: AsyncElasticsearch = Depends(get_es)
+):
+    # regular_search + filter_fragments: los mismos hits (ruta exacta y cache de regular_search) y la misma faceta.
+    # Si ninguno esta en cache y la consulta va por texto completo, las agregaciones viajan en el mismo request
+    try:
+        key = await facets_key(es, search_query, body)
+        facets = aggs_cache.get(key)
+
+        async def search():
+            result = await run_regular_search(es, search_query, body, aggs=FACETA_AGGS_FRAGMENT if facets is None else None)
+            aggregations = result.pop("aggregations", None) # El resultado cacheado es el mismo de regular_search
+            if aggregations is not None:
+                set_facets(key, aggregations) # Tambien le sirve a filter_fragments
+            return result
+
+        result = await cached_regular_search(es, search_query, body, search)
+        if facets is None:
+            # Ruta exacta o resultado que ya estaba en cache: la faceta se pide aparte (o ya la dejo search)
+            facets = await get_facets(es, search_query, body)
+
+        return {**result, **facets}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Las escrituras requieren INGEST_TOKEN, sin el la ingesta por api queda deshabilitada
+def require_ingest_token(request: Request):
+    if not INGEST_TOKEN:
+        raise HTTPException(status_code=403, detail="La ingesta por api esta deshabilitada (INGEST_TOKEN)")
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {INGEST_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Token invalido")
+
+# Cuerpo JSONL: un documento (o {"doc-name": ...} para borrar) por linea
+async def read_jsonl(request: Request) -> list:
+    documentos = []
+    for numero, linea in enumerate((await request.body()).splitlines(), start=1):
+        if not linea.strip():
+            continue
+        try:
+            documento = orjson.loads(linea)
+            documentos.append((document_id(documento), documento))
+        except (ValueError, AttributeError) as e: # JSON invalido, linea que no es un objeto o sin doc-name
+            raise HTTPException(status_code=400, detail=f"Linea {numero}: {e}")
+
+        if len(documentos) > INGEST_MAX_DOCS:
+            raise HTTPException(status_code=413, detail=f"Maximo {INGEST_MAX_DOCS} documentos por peticion")
+
+    if not documentos:
+        raise HTTPException(status_code=400, detail="El cuerpo no contiene documentos")
+    return documentos
+
+async def submit_ingest_job(es: AsyncElasticsearch, operaciones: list) -> JSONResponse:
+    try:
+        await check_no_build(es)
+        job = ingest_queue.submit(operaciones)
+    except IngestBlockedError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except IngestQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "status": job["status"], "total": job["total"]},
+        headers={"Location": f"/api/v1/documents/jobs/{job['id']}"},
+    )
+
+# Crea o reemplaza documentos (id = doc-name), el embedding y el bulk se hacen en segundo plano
+@app.post("/api/v1/documents", dependencies=[Depends(require_ingest_token)])
+async def upsert_documents(request: Request, es: AsyncElasticsearch = Depends(get_es)):
+    return await submit_ingest_job(es, [("index", doc_id, documento) for doc_id, documento in await read_jsonl(request)])
+
+# Borra documentos, acepta el mismo formato de resultados/eliminados.jsonl
+@app.delete("/api/v1/documents", dependencies=[Depends(require_ingest_token)])
+async def delete_documents(request: Request, es: AsyncElasticsearch = Depends(get_es)):
+    return await submit_ingest_job(es, [("delete", doc_id, None) for doc_id, _ in await read_jsonl(request)])
+
+@app.get("/api/v1/documents/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+# Documento completo por _id, para abrir un resultado de una busqueda con view="list"
+@app.get("/api/v1/documents/{doc_id}")
+async def get_document(
+    doc_id: str,
+    es: AsyncElasticsearch = Depends(get_es)
+):
+    try:
+        response = await medir_es(es.get(index=INDEX_NAME, id=doc_id, source_excludes=SOURCE_EXCLUDES))
+        return {"id": response["_id"], **response["_source"]}
+    except NotFoundError:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        response = es.search(
+# Resaltado del body de un solo documento, para las listas pedidas con lazy_highlight
+@app.get("/api/v1/documents/{doc_id}/highlight")
+async def document_highlight(
+    doc_id: str,
+    search_query: str = Query(..., min_length=1),
+    fragments: int = Query(3, ge=1, le=20),
+    es: AsyncElasticsearch = Depends(get_es)
+):
+    try:
+        query = regular_search_query(search_query)
+        registrar_query({"query": query})
+
+        response = await medir_es(es.search(
             index=INDEX_NAME,
             body={
-                "size": 0,
-                "query": query,
-                "aggs": aggs
-            }
-        )
+                "query": {"ids": {"values": [doc_id]}},
+                "size": 1,
+                "_source": False,
+                "highlight": {**highlighter_config(number_of_fragments=fragments), "highlight_query": query}
+            },
+            filter_path=["took", "hits.hits._id", "hits.hits.highlight"]
+        ))
 
-        faceta = build_faceta(response.get("aggregations", {}))
+        hits = response.get("hits", {}).get("hits", [])
+        if not hits:
+            raise HTTPException(status_code=404, detail="Documento no encontrado")
 
-        return {
-            "filters": faceta
-        }
+        return {"id": doc_id, "highlight": hits[0].get("highlight", {})}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Corre la peticion a elastic y la cancela si el cliente se desconecta (el frontend aborta al seguir escribiendo)
+async def cancel_on_disconnect(request: Request, coro):
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=0.05)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise HTTPException(status_code=499, detail="Peticion cancelada por el cliente")
+
+@app.get("/api/v1/suggest")
+async def suggest(
+    request: Request,
+    prefix: str = Query(..., min_length=1, max_length=100),
+    size: int = Query(SUGGEST_SIZE, ge=1, le=20),
+    es: AsyncElasticsearch = Depends(get_es)
+):
+    try:
+        prefix = " ".join(prefix.split())
+        if len(prefix) < SUGGEST_MIN_CHARS:
+            return {"suggestions": []}
+
+        generation = await index_generation.get(es)
+        key = (generation, prefix.lower(), size)
+        suggestions = suggest_cache.get(key)
+        if suggestions is not None:
+            return {"suggestions": suggestions}
+
+        response = await medir_es(cancel_on_disconnect(request, es.options(request_timeout=SUGGEST_TIMEOUT).search(
+            index=INDEX_NAME,
+            body={
+                "query": suggest_query(prefix),
+                "size": size,
+                "_source": ["title", "Numero", "Tipo"],
+                "track_total_hits": False
+            },
+            filter_path=["took", "hits.hits._id", "hits.hits._source"]
+        )))
+
+        suggestions = [
+            {"id": hit["_id"], **hit["_source"]}
+            for hit in response.get("hits", {}).get("hits", [])
+        ]
+        suggest_cache.set(key, suggestions)
+
+        return {"suggestions": suggestions}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/v1/health")
+async def health(es: AsyncElasticsearch = Depends(get_es)):
+    # Liveness: el proceso responde | Readiness: el cluster responde y el indice existe
+    try:
+        cluster = await es.options(request_timeout=2).cluster.health()
+        index_ready = bool(await es.indices.exists(index=INDEX_NAME))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=503, detail=str(e))
+
+    if cluster["status"] == "red" or not index_ready:
+        raise HTTPException(
+            status_code=503,
+            detail={"cluster": cluster["status"], "index_ready": index_ready}
+        )
+
+    return {
+        "status": "ok",
+        "cluster": cluster["status"],
+        "index_ready": index_ready,
+        "embedding_cache": embedding_cache.stats(),
+        "aggs_cache": aggs_cache.stats(),
+        "suggest_cache": suggest_cache.stats(),
+        "result_cache": result_cache.stats(),
+    }
@@ -0,0 +1,139 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+import orjson
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from config import OTEL_ENABLED, SLOW_QUERY_MS
+
+logger = logging.getLogger("buscador.slow_queries")
+
+# OpenTelemetry es opcional: si no esta instalado las etapas solo se miden con prometheus
+try:
+    from opentelemetry import trace
+    tracer = trace.get_tracer("buscador") if OTEL_ENABLED else None
+except ImportError:
+    tracer = None
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    "search_request_seconds",
+    "Duracion total de la peticion",
+    ["endpoint", "status"],
+    buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "search_stage_seconds",
+    "Duracion de cada etapa de la peticion",
+    ["endpoint", "stage"],
+    buckets=_BUCKETS,
+)
+QUERY_ROUTES = Counter(
+    "search_query_routes_total",
+    "Consultas por ruta: exact (solo filtros), exact_fallback (sin resultados, se repitio en texto completo) o full_text",
+    ["route"],
+)
+
+def registrar_ruta(ruta: str):
+    QUERY_ROUTES.labels(route=ruta).inc()
+
+# Expone los contadores de los caches en memoria (LRUCache.stats) al momento del scrape
+class CacheCollector:
+    def __init__(self):
+        self.caches = {}
+
+    def collect(self):
+        hits = CounterMetricFamily("search_cache_hits", "Aciertos del cache", labels=["cache"])
+        misses = CounterMetricFamily("search_cache_misses", "Fallos del cache", labels=["cache"])
+        entries = GaugeMetricFamily("search_cache_entries", "Entradas guardadas en el cache", labels=["cache"])
+        coalesced = CounterMetricFamily("search_cache_coalesced", "Peticiones que esperaron una llamada igual en curso", labels=["cache"])
+
+        for nombre, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([nombre], stats["hits"])
+            misses.add_metric([nombre], stats["misses"])
+            if stats.get("size") is not None:
+                entries.add_metric([nombre], stats["size"])
+            if "coalesced" in stats:
+                coalesced.add_metric([nombre], stats["coalesced"])
+
+        yield hits
+        yield misses
+        yield entries
+        yield coalesced
+
+_cache_collector = CacheCollector()
+REGISTRY.register(_cache_collector)
+
+def registrar_cache(nombre: str, cache):
+    _cache_collector.caches[nombre] = cache
+
+# Etapas de la peticion en curso, las llena etapa() y las reporta el middleware
+_peticion = contextvars.ContextVar("peticion", default=None)
+
+def iniciar_peticion() -> dict:
+    datos = {"etapas": {}, "query": None}
+    _peticion.set(datos)
+    return datos
+
+def registrar_etapa(nombre: str, segundos: float):
+    datos = _peticion.get()
+    if datos is not None:
+        datos["etapas"][nombre] = datos["etapas"].get(nombre, 0.0) + segundos
+
+# Mide un bloque de codigo como una etapa de la peticion (y un span si OpenTelemetry esta activo)
+@contextmanager
+def etapa(nombre: str):
+    span = tracer.start_as_current_span(nombre) if tracer else None
+    if span:
+        span.__enter__()
+
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_etapa(nombre, time.perf_counter() - inicio)
+        if span:
+            span.__exit__(None, None, None)
+
+async def medir(nombre: str, awaitable):
+    with etapa(nombre):
+        return await awaitable
+
+# Tiempo de la llamada a elastic (red incluida) y el took que reporta el cluster
+async def medir_es(awaitable):
+    with etapa("elasticsearch"):
+        respuesta = await awaitable
+
+    took = respuesta.get("took") if hasattr(respuesta, "get") else None
+    if took is not None:
+        registrar_etapa("es_took", took / 1000)
+
+    return respuesta
+
+# Guarda el cuerpo enviado a elastic para el log de consultas lentas
+def registrar_query(cuerpo: dict):
+    datos = _peticion.get()
+    if datos is not None:
+        datos["query"] = cuerpo
+
+def finalizar_peticion(datos: dict, endpoint: str, status: int, total: float) -> str:
+    REQUEST_SECONDS.labels(endpoint=endpoint, status=str(status)).observe(total)
+    for nombre, segundos in datos["etapas"].items():
+        STAGE_SECONDS.labels(endpoint=endpoint, stage=nombre).observe(segundos)
+
+    if total * 1000 >= SLOW_QUERY_MS:
+        query = orjson.dumps(datos["query"], option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8") if datos["query"] else None
+        logger.warning(
+            "Consulta lenta %s %.1fms etapas=%s query=%s",
+            endpoint,
+            total * 1000,
+            {nombre: round(segundos * 1000, 1) for nombre, segundos in datos["etapas"].items()},
+            query,
+        )
+
+    # Header Server-Timing: las herramientas del navegador muestran el desglose
+    etapas = [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in datos["etapas"].items()]
+    return ", ".join(etapas + [f"total;dur={total * 1000:.1f}"])
@@ -1,5 +1,6 @@
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional, Union
+from pydantic import BaseModel, Field
+from config import SEARCH_MAX_LIMIT
 
 class YearFilter(BaseModel):
     year_from : Optional[str] = None
@@ -18,9 +19,26 @@ class SearchFilters(BaseModel):
     must          : Optional[List[str]] = None
     should        : Optional[List[str]] = None
     years         : Optional[YearFilter] = None 
-    entity        : Optional[str] = None
+    entity        : Optional[Union[str, List[str]]] = None  # Lista = "keys" de una entidad agrupada en la faceta
     
 class SearchBody(BaseModel):
-    skip    : int = 0
-    limit   : int = 10
-    filters : Optional[SearchFilters] = None
+    skip             : int = Field(0, ge=0)
+    limit            : int = Field(10, ge=1, le=SEARCH_MAX_LIMIT or None)  # limit=0 dividiria por cero en max_pages y dejaria el cursor sin ultimo hit
+    filters          : Optional[SearchFilters] = None
+    use_cursor       : bool = False          # Pagina con point-in-time + search_after en vez de from/size
+    cursor           : Optional[str] = None  # next_cursor devuelto por la pagina anterior
+    track_total_hits : Optional[Union[bool, int]] = None  # Cuenta exacta solo hasta este valor (o true/false como en elastic), abarata el total
+    profile          : bool = False          # Devuelve el profile de elastic, requiere ES_PROFILE_ENABLED
+    lazy_highlight   : bool = False          # No resalta el body en la lista, se pide por documento a /documents/{id}/highlight
+    view             : Literal["list", "detail"] = "detail"  # list: solo metadatos + highlight, el documento se pide a /documents/{id}
+
+class HybridOptions(BaseModel):
+    fusion         : Literal["rrf", "linear"] = "rrf"  # rrf: fusion en el servicio | linear: suma de puntajes en elastic
+    k              : int = 50     # Vecinos que devuelve el knn
+    num_candidates : int = 100    # Candidatos por shard que revisa el HNSW
+    rank_constant  : int = 60     # Constante de RRF, valores altos suavizan la diferencia entre posiciones
+    knn_boost      : float = 1.0  # Pesos para la fusion lineal
+    bm25_boost     : float = 1.0
+
+class HybridSearchBody(SearchBody):
+    hybrid : HybridOptions = HybridOptions()
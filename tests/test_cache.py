@@ -0,0 +1,50 @@
+import asyncio
+from elasticsearch import NotFoundError
+from cache import IndexGeneration, LRUCache
+
+class _Indices:
+    def __init__(self, mappings):
+        self.mappings = mappings
+        self.llamadas = 0
+
+    async def get_mapping(self, index):
+        self.llamadas += 1
+        if self.mappings is None:
+            raise NotFoundError("index_not_found_exception", None, {})
+        return self.mappings
+
+class _Es:
+    def __init__(self, mappings):
+        self.indices = _Indices(mappings)
+
+def _mapping(generation=None):
+    return {"mappings": {"_meta": {"build": False, "generation": generation}} if generation else {}}
+
+def test_lru_expulsa_el_menos_usado():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+def test_generacion_cambia_con_meta():
+    es = _Es({"prueba-1": _mapping("x")})
+    generacion = IndexGeneration("prueba", check_interval=60)
+    antes = asyncio.run(generacion.get(es))
+
+    # Otro worker escribio: hasta el siguiente chequeo se sigue usando la generacion anterior
+    es.indices.mappings = {"prueba-1": _mapping("y")}
+    assert asyncio.run(generacion.get(es)) == antes
+
+    generacion.invalidate()
+    assert asyncio.run(generacion.get(es)) != antes
+    assert es.indices.llamadas == 2
+
+def test_generacion_igual_entre_workers():
+    es = _Es({"prueba-1": _mapping("x")})
+    assert asyncio.run(IndexGeneration("prueba").get(es)) == asyncio.run(IndexGeneration("prueba").get(es))
+
+def test_generacion_sin_meta_ni_indice():
+    assert asyncio.run(IndexGeneration("prueba").get(_Es({"prueba": _mapping()}))) == "prueba#"
+    assert asyncio.run(IndexGeneration("prueba").get(_Es(None))) == "prueba"
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import time
+import numpy as np
+from embeddings import BatchEncoder
+
+def test_agrupa_y_devuelve_copias():
+    llamadas = []
+
+    def encode(textos):
+        llamadas.append(textos)
+        return np.arange(len(textos) * 2, dtype=np.float32).reshape(len(textos), 2)
+
+    async def main():
+        encoder = BatchEncoder(encode=encode, window_ms=5)
+        return await asyncio.gather(encoder.encode("a"), encoder.encode("b"), encoder.encode("a"))
+
+    a, b, a2 = asyncio.run(main())
+    assert llamadas == [["a", "b"]]
+    assert a.base is None and np.array_equal(a, a2) and b.tolist() == [2.0, 3.0]
+
+def test_timeout_mantiene_el_cupo_hasta_que_termina():
+    activos, maximo = [0], [0]
+    lock = threading.Lock()
+
+    def encode(textos):
+        with lock:
+            activos[0] += 1
+            maximo[0] = max(maximo[0], activos[0])
+        time.sleep(0.1)
+        with lock:
+            activos[0] -= 1
+        return np.zeros((len(textos), 2), dtype=np.float32)
+
+    async def main():
+        encoder = BatchEncoder(encode=encode, window_ms=1, max_batch=1, max_concurrency=1, timeout=0.02)
+        resultados = await asyncio.gather(*(encoder.encode(str(i)) for i in range(3)), return_exceptions=True)
+        await asyncio.sleep(0.4) # Los encodes vencidos terminan en el executor
+        return resultados
+
+    resultados = asyncio.run(main())
+    assert all(isinstance(r, asyncio.TimeoutError) for r in resultados)
+    assert maximo[0] == 1 # El timeout no libero el cupo mientras el hilo seguia codificando
@@ -0,0 +1,90 @@
+import copy
+import os
+import orjson
+from faceta import ClasificadorFaceta, _ClasificadorRecargable, agrupar_entidades
+
+JERARQUIA = {
+    "Normativa": ["constituciones", "leyes", "decretos"],
+    "Jurisprudencia": ["corte constitucional", "comision de regulacion DE DISIPLINA"],
+}
+
+def _year(anio, doc_count):
+    return {"key": anio, "key_as_string": str(anio), "doc_count": doc_count}
+
+def _aggs(*tipos):
+    return {"tipo": {
+        "doc_count_error_upper_bound": 0,
+        "sum_other_doc_count": 0,
+        "buckets": [{"key": tipo, "doc_count": 1} for tipo in tipos],
+    }}
+
+def test_clasificar_por_prefijo_sin_tildes_ni_mayusculas():
+    clasificador = ClasificadorFaceta(JERARQUIA)
+
+    assert clasificador.clasificar("Leyes") == ("Normativa", 1)
+    assert clasificador.clasificar("DECRETOS LEY") == ("Normativa", 2)
+    assert clasificador.clasificar("Comisión de Regulación de Disiplina") == ("Jurisprudencia", 1)
+    assert clasificador.clasificar("Resoluciones") == (None, 0)
+
+def test_clasificar_gana_el_primer_grupo():
+    clasificador = ClasificadorFaceta({"A": ["ley"], "B": ["leyes"]})
+
+    assert clasificador.clasificar("Leyes") == ("A", 0)
+
+def test_build_ordena_segun_la_jerarquia():
+    faceta = ClasificadorFaceta(JERARQUIA).build(_aggs("Corte Constitucional", "Decretos", "Leyes", "Otros", "Constituciones"))
+
+    assert [b["key"] for b in faceta["tipo"]["normativa"]] == ["Constituciones", "Leyes", "Decretos"]
+    assert [b["key"] for b in faceta["tipo"]["jurisprudencia"]] == ["Corte Constitucional"]
+    assert [b["key"] for b in faceta["tipo"]["other"]] == ["Otros"]
+
+def test_build_no_modifica_la_respuesta_de_elastic():
+    aggs = _aggs("Leyes", "Otros")
+    aggs["tipo"]["buckets"][0]["entidad"] = {"buckets": [{"key": "Congreso", "doc_count": 1, "year": {"buckets": [_year(1993, 1)]}}]}
+    original = copy.deepcopy(aggs)
+
+    ClasificadorFaceta(JERARQUIA).build(aggs)
+
+    assert aggs == original
+
+def test_build_sin_tipo():
+    assert ClasificadorFaceta(JERARQUIA).build({}) == {}
+
+def test_agrupar_entidades_suma_variantes_y_conserva_las_llaves():
+    entidades = agrupar_entidades([
+        {"key": "Ministerio de Salud", "doc_count": 2, "year": {"buckets": [_year(1990, 2)]}},
+        {"key": "MINISTERIO DE SALUD", "doc_count": 1, "year": {"buckets": [_year(1990, 1), _year(1991, 1)]}},
+        {"key": "Congreso", "doc_count": 4, "year": {"buckets": [_year(1993, 4)]}},
+    ])
+
+    salud, congreso = entidades
+    assert salud["keys"] == ["Ministerio de Salud", "MINISTERIO DE SALUD"]
+    assert salud["doc_count"] == 3
+    assert salud["year"]["buckets"] == [_year(1990, 3), _year(1991, 1)]
+    assert congreso["keys"] == ["Congreso"]
+    assert congreso["year"]["buckets"] == [_year(1993, 4)]
+
+def test_recarga_cuando_cambia_el_mtime(tmp_path):
+    path = tmp_path / "jerarquia.json"
+    path.write_bytes(orjson.dumps({"Normativa": ["leyes"]}))
+    recargable = _ClasificadorRecargable(str(path), check_interval=0)
+
+    assert recargable.get().clasificar("Decretos") == (None, 0)
+
+    path.write_bytes(orjson.dumps({"Normativa": ["leyes", "decretos"]}))
+    mtime = os.stat(path).st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime, mtime))
+
+    assert recargable.get().clasificar("Decretos") == ("Normativa", 1)
+
+def test_archivo_invalido_conserva_la_version_anterior(tmp_path):
+    path = tmp_path / "jerarquia.json"
+    path.write_bytes(orjson.dumps({"Normativa": ["leyes"]}))
+    recargable = _ClasificadorRecargable(str(path), check_interval=0)
+    anterior = recargable.get()
+
+    path.write_bytes(b"{no es json")
+    mtime = os.stat(path).st_mtime_ns + 1_000_000_000
+    os.utime(path, ns=(mtime, mtime))
+
+    assert recargable.get() is anterior
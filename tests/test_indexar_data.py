@@ -0,0 +1,32 @@
+import json
+import pytest
+from indexar_data import _read_documents
+
+DOCUMENTOS = [{"doc-name": f"doc-{i}", "body": "texto " * i} for i in range(50)]
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 1 << 20])
+def test_arreglo_json_por_pedazos(tmp_path, chunk_size):
+    archivo = tmp_path / "datos.json"
+    archivo.write_text(" [\n" + ",\n  ".join(json.dumps(d) for d in DOCUMENTOS) + "\n]\n", encoding="utf-8")
+    assert list(_read_documents(str(archivo), chunk_size=chunk_size)) == DOCUMENTOS
+
+def test_jsonl(tmp_path):
+    archivo = tmp_path / "datos.jsonl"
+    archivo.write_text("\n".join(json.dumps(d) for d in DOCUMENTOS) + "\n\n", encoding="utf-8")
+    assert list(_read_documents(str(archivo))) == DOCUMENTOS
+
+def test_arreglo_vacio_e_invalido(tmp_path):
+    vacio = tmp_path / "vacio.json"
+    vacio.write_text("[ ]", encoding="utf-8")
+    assert list(_read_documents(str(vacio))) == []
+
+    objeto = tmp_path / "objeto.json"
+    objeto.write_text('{"doc-name": "a"}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(_read_documents(str(objeto)))
+
+def test_arreglo_truncado(tmp_path):
+    archivo = tmp_path / "truncado.json"
+    archivo.write_text('[{"doc-name": "a"}, {"doc-na', encoding="utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        list(_read_documents(str(archivo), chunk_size=8))
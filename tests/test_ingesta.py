@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+from ingesta import IngestBlockedError, check_no_build, unpublished_builds
+
+# Responde como get_mapping con filter_path="*.mappings._meta": los indices sin _meta no aparecen
+class _Indices:
+    def __init__(self, metas: dict):
+        self.metas = metas
+
+    async def get_mapping(self, index, expand_wildcards, filter_path):
+        return {nombre: {"mappings": {"_meta": meta}} for nombre, meta in self.metas.items() if meta is not None}
+
+class _Es:
+    def __init__(self, metas: dict):
+        self.indices = _Indices(metas)
+
+def test_sin_reconstruccion():
+    es = _Es({"prueba-20240101000000": None, "prueba-20240201000000": {"build": False}})
+    assert asyncio.run(unpublished_builds(es)) == []
+    asyncio.run(check_no_build(es))
+
+def test_version_nueva_sin_publicar():
+    es = _Es({"prueba-20240101000000": {"build": False}, "prueba-20240301000000": {"build": True}})
+    assert asyncio.run(unpublished_builds(es)) == ["prueba-20240301000000"]
+    with pytest.raises(IngestBlockedError):
+        asyncio.run(check_no_build(es))
+
+def test_rollback_no_bloquea():
+    # Despues de --rollback el alias vuelve a la version vieja y la nueva (ya publicada una vez) queda sin marca
+    es = _Es({"prueba-20240101000000": {"build": False}, "prueba-20240301000000": {"build": False}})
+    assert asyncio.run(unpublished_builds(es)) == []
+    asyncio.run(check_no_build(es))
@@ -0,0 +1,24 @@
+import pytest
+from pydantic import ValidationError
+from models import HybridSearchBody, SearchBody
+
+def test_paginacion_por_defecto():
+    body = SearchBody()
+    assert (body.skip, body.limit) == (0, 10)
+
+@pytest.mark.parametrize("campos", [{"limit": 0}, {"limit": -1}, {"skip": -1}])
+def test_paginacion_invalida(campos):
+    with pytest.raises(ValidationError):
+        SearchBody(**campos)
+
+def test_hybrid_hereda_validacion():
+    with pytest.raises(ValidationError):
+        HybridSearchBody(limit=0)
+
+def test_limit_sin_tope_por_defecto():
+    assert SearchBody(limit=500).limit == 500
+
+@pytest.mark.parametrize("valor", [True, False, 1000])
+def test_track_total_hits_como_elastic(valor):
+    track_total_hits = SearchBody(track_total_hits=valor).track_total_hits
+    assert type(track_total_hits) is type(valor) and track_total_hits == valor # true no se convierte en 1
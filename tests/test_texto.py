@@ -0,0 +1,10 @@
+from texto import limpiar_html
+
+def test_inline_no_parte_palabras():
+    assert limpiar_html("<p>El art<b>í</b>culo <span>1</span></p>") == "El artículo 1"
+
+def test_bloques_se_separan():
+    assert limpiar_html("<p>Uno</p><p>dos<br>tres</p><table><tr><td>a</td><td>b</td></tr></table>") == "Uno dos tres a b"
+
+def test_texto_plano():
+    assert limpiar_html("ley&nbsp;100   de 1993") == "ley 100 de 1993"
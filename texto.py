@@ -0,0 +1,69 @@
+import html
+import re
+import lxml.html
+from lxml import etree
+
+# Etiquetas cuyo contenido no es texto del documento
+_RUIDO = ("script", "style", "noscript", "iframe", "object", "template", etree.Comment)
+_MARCADO = re.compile(r"<[a-zA-Z/!?]")
+_ESPACIOS = re.compile(r"\s+")
+# Espacios especiales y caracteres de control que dejan los .htm exportados desde Word
+_INVISIBLES = str.maketrans({
+    "\xa0": " ",
+    "\u200b": " ",
+    "\ufeff": " ",
+    "\xad": "",
+    **{chr(c): " " for c in range(0x00, 0x20) if chr(c) not in "\t\n\r"},
+    "\x7f": " ",
+})
+
+# Secuencias UTF-8 leidas como cp1252 ("Ã³" en vez de "ó"): byte inicial + bytes de continuacion
+_MOJIBAKE = re.compile(
+    "[\u00c2-\u00f4][\u0080-\u00bf\u0152\u0153\u0160\u0161\u0178\u017d\u017e\u0192\u02c6\u02dc"
+    "\u2013\u2014\u2018-\u201a\u201c-\u201e\u2020-\u2022\u2026\u2030\u2039\u203a\u20ac\u2122]{1,3}"
+)
+
+def _reparar_secuencia(match: re.Match) -> str:
+    try:
+        return match.group(0).encode("cp1252").decode("utf-8")
+    except UnicodeError:
+        return match.group(0) # Texto legitimo (p.ej. "é»"), se deja igual
+
+def _reparar_mojibake(texto: str) -> str:
+    if "Ã" not in texto and "Â" not in texto and "â€" not in texto:
+        return texto
+    return _MOJIBAKE.sub(_reparar_secuencia, texto)
+
+def normalizar_texto(texto: str) -> str:
+    texto = _reparar_mojibake(texto).translate(_INVISIBLES)
+    return _ESPACIOS.sub(" ", texto).strip()
+
+# Elementos que cortan el texto, entre ellos va un espacio. Los inline (span, b, i, a, font...) se concatenan tal cual:
+# Word parte palabras entre etiquetas ("art<b>í</b>culo")
+_BLOQUES = (
+    "address", "article", "aside", "blockquote", "br", "caption", "dd", "div", "dl", "dt", "figcaption", "footer",
+    "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "ol", "p", "pre", "section", "table", "tbody", "td",
+    "tfoot", "th", "thead", "title", "tr", "ul",
+)
+
+# Texto de un elemento lxml sin scripts/estilos/comentarios, con espacios solo en los limites de bloque
+def extraer_texto(elemento) -> str:
+    etree.strip_elements(elemento, *_RUIDO, with_tail=False)
+    for bloque in elemento.iter(*_BLOQUES):
+        bloque.text = " " + (bloque.text or "")
+        bloque.tail = " " + (bloque.tail or "")
+    return normalizar_texto("".join(elemento.itertext()))
+
+# Limpia un texto que puede o no traer html, sin construir un arbol cuando no hay etiquetas
+def limpiar_html(texto: str) -> str:
+    if not texto:
+        return ""
+
+    if not _MARCADO.search(texto):
+        # Consultas de usuario y texto plano: solo entidades y espacios
+        return normalizar_texto(html.unescape(texto) if "&" in texto else texto)
+
+    try:
+        return extraer_texto(lxml.html.fragment_fromstring(texto, create_parent="div"))
+    except (etree.ParserError, ValueError):
+        return normalizar_texto(html.unescape(texto))
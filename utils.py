@@ -1,15 +1,78 @@
+import base64
+import json
 import time
 from pprint import pprint
-from elasticsearch import Elasticsearch
-from config import JERARQUIA_FACETA
+from typing import Optional
+import orjson
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+from elasticsearch.serializer import JsonSerializer
+from elastic_transport import SerializationError
+from config import (
+    ES_CONNECTIONS_PER_NODE,
+    ES_HOST,
+    ES_MAX_RETRIES,
+    ES_REQUEST_TIMEOUT,
+    ES_RETRY_ON_STATUS,
+)
+from faceta import get_clasificador
 from models import SearchFilters
 
+# Serializa con orjson: mas rapido y los vectores numpy float32 salen con su representacion corta
+# (~9 caracteres por componente en vez de los ~20 de convertirlos a float de python con tolist)
+class OrjsonSerializer(JsonSerializer):
+    def dumps(self, data) -> bytes:
+        if isinstance(data, str):
+            return data.encode("utf-8", "surrogatepass")
+        return orjson.dumps(data, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data: bytes):
+        if data == b"":
+            return None
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(f"Unable to deserialize as JSON: {data!r}", errors=(e,))
+
+# Mismo serializador para el cuerpo de los bulk / msearch (una linea JSON por operacion)
+class OrjsonNdjsonSerializer(OrjsonSerializer):
+    mimetype = "application/x-ndjson"
+
+    def dumps(self, data) -> bytes:
+        if isinstance(data, (bytes, str)):
+            data = (data,)
+
+        buffer = bytearray()
+        for line in data:
+            if isinstance(line, str):
+                line = line.encode("utf-8", "surrogatepass")
+            elif not isinstance(line, bytes):
+                line = super().dumps(line)
+            buffer += line
+            if not line.endswith(b"\n"):
+                buffer += b"\n"
+
+        return bytes(buffer)
+
+# Opciones de transporte compartidas por el cliente sincrono y el asincrono
+def _es_client_options() -> dict:
+    return {
+        "serializers": {
+            "application/json": OrjsonSerializer(),
+            "application/x-ndjson": OrjsonNdjsonSerializer(),
+        },
+        "connections_per_node": ES_CONNECTIONS_PER_NODE,
+        "request_timeout": ES_REQUEST_TIMEOUT,
+        "max_retries": ES_MAX_RETRIES,
+        "retry_on_timeout": True,
+        "retry_on_status": ES_RETRY_ON_STATUS,
+    }
+
 # Devuelve una conexion con elastic
 def get_es_client(max_retries: int = 1, sleep_time: int = 5) -> Elasticsearch:
     i = 0
     while i < max_retries:
         try:
-            es = Elasticsearch("http://localhost:9200")
+            es = Elasticsearch(ES_HOST, **_es_client_options())
             return es
         except Exception:
             pprint("Could not connect to Elasticsearch, retrying...")
@@ -17,6 +80,31 @@ def get_es_client(max_retries: int = 1, sleep_time: int = 5) -> Elasticsearch:
             i += 1
     raise ConnectionError("Failed to connect to Elasticsearch after multiple attempts.")
 
+# Cliente asincrono con pool de conexiones, se crea una sola vez durante el lifespan de la app
+def get_async_es_client() -> AsyncElasticsearch:
+    return AsyncElasticsearch(ES_HOST, **_es_client_options())
+
+# Cursor opaco para la paginacion con search_after: id del point-in-time + sort del ultimo hit
+def encode_cursor(pit_id: str, search_after: list) -> str:
+    payload = json.dumps({"pit_id": pit_id, "search_after": search_after}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(payload["pit_id"], str) or not isinstance(payload["search_after"], list):
+            raise ValueError
+        return payload
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Cursor invalido")
+
+# Normaliza el texto de busqueda para usarlo como llave de cache (no se cambian mayusculas, los term son sensibles)
+def normalize_search_query(search_query: str) -> str:
+    return " ".join(search_query.split())
+
+def filters_key(filters: Optional[SearchFilters]) -> str:
+    return filters.model_dump_json(exclude_none=True) if filters else ""
+
 # Construye el query de busqueda, agregando filtros
 def build_query(
     query         : dict,
@@ -82,7 +170,8 @@ def build_query(
             
     if filters.entity:
         bool_query.setdefault("filter", []).append(
-            {"term": {"Entidad.keyword": filters.entity}}
+            {"terms": {"Entidad.keyword": filters.entity}} if isinstance(filters.entity, list)
+            else {"term": {"Entidad.keyword": filters.entity}}
         )
 
     if filters.years and filters.years.year_from is not None and filters.years.year_to is not None:
@@ -100,57 +189,32 @@ def build_query(
 
     return query
 
+# Extrae las clausulas de filtrado del query para aplicarlas tambien en el knn
+def knn_filter(query: dict) -> Optional[dict]:
+    bool_query = query.get("bool", {})
+    filtro = bool_query.get("filter", []) + bool_query.get("must", []) # Los must restringen resultados, en el knn son filtros
+    must_not = bool_query.get("must_not", [])
+
+    if not filtro and not must_not:
+        return None
+
+    knn_bool = {}
+    if filtro:
+        knn_bool["filter"] = filtro
+    if must_not:
+        knn_bool["must_not"] = must_not
+
+    return {"bool": knn_bool}
+
+# Reciprocal Rank Fusion: puntaje = suma de 1 / (rank_constant + posicion) en cada lista
+def reciprocal_rank_fusion(rankings: list, rank_constant: int = 60) -> list:
+    scores = {}
+    for ranking in rankings:
+        for posicion, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rank_constant + posicion)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
 # Construye la Jerarquía de la normativa y jurisprudencia
 def build_faceta(aggs: dict) -> dict:
-    if not aggs or "tipo" not in aggs:
-        return {}
-
-    normativa = []
-    jurisprudencia = []
-    otros = []
-
-    for tipo_doc in aggs["tipo"]["buckets"]:
-        tipo = tipo_doc["key"].lower()
-        matched = False
-
-        # Normativa
-        for clave in JERARQUIA_FACETA["Normativa"]:
-            if tipo.startswith(clave):
-                tipo_doc["_orden"] = clave  # <-- guardamos la palabra clave
-                normativa.append(tipo_doc)
-                matched = True
-                break
-
-        if matched:
-            continue
-
-        # Jurisprudencia
-        for clave in JERARQUIA_FACETA["Jurisprudencia"]:
-            if tipo.startswith(clave):
-                tipo_doc["_orden"] = clave
-                jurisprudencia.append(tipo_doc)
-                matched = True
-                break
-
-        if not matched:
-            otros.append(tipo_doc)
-
-    # Mapa de orden
-    orden_normativa = {tipo: idx for idx, tipo in enumerate(JERARQUIA_FACETA["Normativa"])}
-    orden_jurisprudencia = {tipo: idx for idx, tipo in enumerate(JERARQUIA_FACETA["Jurisprudencia"])}
-
-    # Sorting usando la palabra clave
-    normativa.sort(key=lambda x: orden_normativa.get(x["_orden"], 999))
-    jurisprudencia.sort(key=lambda x: orden_jurisprudencia.get(x["_orden"], 999))
-
-    faceta = {
-        "tipo": {
-            "doc_count_error_upper_bound": aggs["tipo"]["doc_count_error_upper_bound"],
-            "sum_other_doc_count": aggs["tipo"]["sum_other_doc_count"],
-            "normativa": normativa,
-            "jurisprudencia": jurisprudencia,
-            "other": otros,
-        }
-    }
-
-    return faceta
\ No newline at end of file
+    return get_clasificador().build(aggs)